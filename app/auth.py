@@ -3,11 +3,12 @@
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+import asyncio
 import os
 from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from app.db import buscar_usuario
+from app.db import buscar_usuario, buscar_usuario_em_cache
 
 # Carrega variáveis do .env
 load_dotenv()
@@ -37,7 +38,9 @@ def create_access_token(data: dict) -> str:
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_current_username(token: str = Depends(oauth2_scheme)) -> str:
+# async: só decodifica o JWT (CPU, sem I/O), então roda no event loop em vez de
+# ocupar uma thread do threadpool a cada request autenticado
+async def get_current_username(token: str = Depends(oauth2_scheme)) -> str:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Token inválido ou expirado",
@@ -53,8 +56,14 @@ def get_current_username(token: str = Depends(oauth2_scheme)) -> str:
         raise credentials_exception
 
 
-def get_current_user(username: str = Depends(get_current_username)) -> dict:
-    user = buscar_usuario(username)
+# async: com o usuário no cache curto não há I/O; só o miss vai para uma thread.
+# Só autentica: não checa has_access (o front bloqueia pelo has_access do /me, que
+# precisa responder também para quem ainda não pagou).
+async def get_current_user(username: str = Depends(get_current_username)) -> dict:
+    user = buscar_usuario_em_cache(username)
+    if user is None:
+        # nenhuma rota usa os logs do current_user
+        user = await asyncio.to_thread(buscar_usuario, username, False)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,15 +1,24 @@
 import os
-from datetime import datetime
-from typing import Any, Dict, Optional, List
+import time
+import logging
+import threading
+from collections import deque
+from itertools import islice
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, List, Tuple
 from contextlib import contextmanager
-from uuid import uuid4
+from uuid import UUID as _PyUUID
+
+from cachetools import LRUCache, TTLCache
 
 from sqlalchemy import (
-    create_engine, select, func, String, Float, Text, Boolean, Integer,
-    DateTime, ForeignKey, Enum, text
+    create_engine, select, insert, update, func, String, Float, Text, Boolean, Integer,
+    DateTime, ForeignKey, Enum, Index, bindparam, case, cast, event, text
 )
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, sessionmaker
-from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, selectinload, sessionmaker
+from sqlalchemy.dialects.postgresql import UUID, JSONB, insert as pg_insert
+
+logger = logging.getLogger(__name__)
 
 # =========================
 # Conexão / Engine / Sessão
@@ -28,7 +37,36 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("❌ DATABASE_URL não definida no .env")
 
-ENGINE = create_engine(_normalize_database_url(DATABASE_URL), pool_pre_ping=True)
+def _prepare_threshold() -> Optional[int]:
+    # 0 = prepara no servidor já na 1ª execução; "none" desliga (pgbouncer em modo transaction)
+    raw = os.getenv("DB_PREPARE_THRESHOLD", "0").strip().lower()
+    return None if raw in ("", "none", "off") else int(raw)
+
+# Pool LIFO mantém poucas conexões quentes; keepalive TCP + recycle substituem o
+# pre-ping (um SELECT 1 extra a cada checkout). Tamanho ajustável por ambiente
+# (ex.: menor atrás de pgbouncer); pool esgotado falha em DB_POOL_TIMEOUT s em vez de 30.
+ENGINE = create_engine(
+    _normalize_database_url(DATABASE_URL),
+    pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+    pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    pool_recycle=300,
+    pool_use_lifo=True,
+    insertmanyvalues_page_size=1000,
+    connect_args={
+        "keepalives": 1,
+        "keepalives_idle": 30,
+        "keepalives_interval": 10,
+        "prepare_threshold": _prepare_threshold(),
+    },
+)
+
+@event.listens_for(ENGINE, "handle_error")
+def _invalidate_only_broken_connection(ctx):
+    # sem pre-ping, uma conexão morta aparece como erro de desconexão na primeira query;
+    # descarta só ela em vez de invalidar o pool inteiro
+    if ctx.is_disconnect:
+        ctx.invalidate_pool_on_disconnect = False
 SessionLocal = sessionmaker(bind=ENGINE, autocommit=False, autoflush=False)
 
 @contextmanager
@@ -43,6 +81,22 @@ def session_scope():
     finally:
         db.close()
 
+def _uuid7() -> _PyUUID:
+    """UUIDv7 (RFC 9562): prefixo de 48 bits com o timestamp em ms, ordenável no índice."""
+    ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (
+        (ms & 0xFFFF_FFFF_FFFF) << 80
+        | 0x7 << 76
+        | ((rand >> 62) & 0xFFF) << 64
+        | 0b10 << 62
+        | (rand & 0x3FFF_FFFF_FFFF_FFFF)
+    )
+    return _PyUUID(int=value)
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
 # =========================
 # Modelos SQLAlchemy
 # =========================
@@ -52,7 +106,7 @@ class Base(DeclarativeBase):
 class User(Base):
     __tablename__ = "users"
 
-    id: Mapped[str] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    id: Mapped[_PyUUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=_uuid7)
     username: Mapped[str] = mapped_column(String(255), unique=True, index=True, nullable=False)
     password_hash: Mapped[Optional[str]] = mapped_column(String(255))
 
@@ -75,42 +129,60 @@ class User(Base):
     is_admin: Mapped[bool] = mapped_column(Boolean, default=False, server_default="false")
     avatar_url: Mapped[Optional[str]] = mapped_column(Text)
 
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=_utcnow, server_default=func.now(), nullable=False)
 
-    weight_logs: Mapped[List["WeightLog"]] = relationship(back_populates="user", cascade="all, delete-orphan")
-    chats: Mapped[List["ChatMessage"]] = relationship(back_populates="user", cascade="all, delete-orphan")
-    meals: Mapped[List["MealAnalysis"]] = relationship(back_populates="user", cascade="all, delete-orphan")
+    weight_logs: Mapped[List["WeightLog"]] = relationship(
+        back_populates="user", cascade="all, delete-orphan", order_by="WeightLog.recorded_at"
+    )
+    # nunca carregados via User: lazy="raise" denuncia N+1 acidental; o CASCADE do FK apaga no banco
+    chats: Mapped[List["ChatMessage"]] = relationship(
+        back_populates="user", cascade="all, delete-orphan", lazy="raise", passive_deletes=True
+    )
+    meals: Mapped[List["MealAnalysis"]] = relationship(
+        back_populates="user", cascade="all, delete-orphan", lazy="raise", passive_deletes=True
+    )
 
 class WeightLog(Base):
     __tablename__ = "weight_logs"
-    id: Mapped[str] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
-    user_id: Mapped[str] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), index=True)
-    recorded_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # selectin de User.weight_logs, /weight-logs e dashboard: WHERE user_id ORDER BY recorded_at
+    __table_args__ = (
+        Index("ix_weight_user_recorded", "user_id", "recorded_at"),
+    )
+    id: Mapped[_PyUUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=_uuid7)
+    user_id: Mapped[_PyUUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"))
+    recorded_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=_utcnow, server_default=func.now(), nullable=False)
     weight: Mapped[float] = mapped_column(Float, nullable=False)
     user: Mapped["User"] = relationship(back_populates="weight_logs")
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
-    id: Mapped[str] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
-    user_id: Mapped[str] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    # histórico: WHERE user_id = ? ORDER BY created_at DESC LIMIT n sai direto do índice.
+    # Sem INCLUDE(text, ...): respostas longas passariam do limite de ~2.7 kB por tupla
+    # do btree e o INSERT falharia; n leituras no heap por página de histórico é barato.
+    __table_args__ = (
+        Index("ix_chat_user_created", "user_id", "created_at", postgresql_ops={"created_at": "DESC"}),
+    )
+    id: Mapped[_PyUUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=_uuid7)
+    user_id: Mapped[_PyUUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"))
     role: Mapped[str] = mapped_column(Enum("user", "assistant", "bot", name="chat_role"), nullable=False)
     text: Mapped[str] = mapped_column(Text, nullable=False)
     type: Mapped[Optional[str]] = mapped_column(Enum("text", "image", name="message_type"))
     image_url: Mapped[Optional[str]] = mapped_column(Text)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=_utcnow, server_default=func.now(), nullable=False)
     user: Mapped["User"] = relationship(back_populates="chats")
 
 class MealAnalysis(Base):
     __tablename__ = "meal_analyses"
-    id: Mapped[str] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
-    user_id: Mapped[str] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    __table_args__ = (
+        Index("ix_meal_user_created", "user_id", "created_at", postgresql_ops={"created_at": "DESC"}),
+    )
+    id: Mapped[_PyUUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=_uuid7)
+    user_id: Mapped[_PyUUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"))
     analysis: Mapped[dict] = mapped_column(JSONB, nullable=False)
     image_name: Mapped[Optional[str]] = mapped_column(Text)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=_utcnow, server_default=func.now(), nullable=False)
     user: Mapped["User"] = relationship(back_populates="meals")
 
-Base.metadata.create_all(bind=ENGINE)
-
 def _ensure_pg_enums():
     with ENGINE.begin() as conn:
         conn.execute(text("""
@@ -135,14 +207,46 @@ def _ensure_pg_enums():
         END $$;
         """))
 
-_ensure_pg_enums()
+def _ensure_pg_indexes():
+    # create_all não cria índices em tabelas já existentes; CONCURRENTLY exige autocommit
+    with ENGINE.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_chat_user_created ON chat_messages (user_id, created_at DESC)"))
+        conn.execute(text("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_meal_user_created ON meal_analyses (user_id, created_at DESC)"))
+        conn.execute(text("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_weight_user_recorded ON weight_logs (user_id, recorded_at)"))
+        # o índice composto cobre buscas só por user_id
+        conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_chat_messages_user_id"))
+        conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_meal_analyses_user_id"))
+        conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_weight_logs_user_id"))
+
+_SCHEMA_LOCK_ID = 42
+_SCHEMA_READY = False  # idempotente: app + scripts podem chamar mais de uma vez
+
+def init_schema() -> None:
+    """
+    Cria tabelas/enums/índices. Roda no startup da app (não no import), serializado
+    entre workers por advisory lock. Com RUN_DDL=0 o worker pula o DDL (ex.: quando
+    um job de migração dedicado já cuidou disso).
+    """
+    global _SCHEMA_READY
+    if _SCHEMA_READY or os.getenv("RUN_DDL", "1") == "0":
+        return
+    with ENGINE.connect() as lock_conn:
+        lock_conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": _SCHEMA_LOCK_ID})
+        try:
+            Base.metadata.create_all(bind=ENGINE)
+            _ensure_pg_enums()
+            _ensure_pg_indexes()
+            _SCHEMA_READY = True
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _SCHEMA_LOCK_ID})
+            lock_conn.commit()
 
 # =========================
 # Helpers de usuário
 # =========================
-def _user_to_dict(u: User) -> Dict[str, Any]:
+def _user_to_dict(u: User, *, load_logs: bool = True) -> Dict[str, Any]:
     return {
-        "id": str(u.id),
+        "id": u.id,  # uuid.UUID; orjson/pydantic convertem na borda
         "username": u.username,
         "password": u.password_hash,
         "password_hash": u.password_hash,
@@ -162,8 +266,8 @@ def _user_to_dict(u: User) -> Dict[str, Any]:
 
         "weight_logs": [
             {"weight": wl.weight, "recorded_at": wl.recorded_at.isoformat()}
-            for wl in sorted(u.weight_logs, key=lambda x: x.recorded_at)
-        ],
+            for wl in u.weight_logs
+        ] if load_logs else [],
         "refeicoes": [],
         "chat_history": [],
 
@@ -175,136 +279,367 @@ def _user_to_dict(u: User) -> Dict[str, Any]:
 
 from sqlalchemy import select as _select  # evitar shadow
 
-def buscar_usuario(username: str) -> Optional[Dict[str, Any]]:
+# Statements montados uma vez; cada chamada só passa os parâmetros.
+# weight_logs vem numa segunda query (selectin) em vez de um lazy load por acesso.
+_SEL_USER_BY_NAME = _select(User).options(selectinload(User.weight_logs)).where(User.username == bindparam("uname"))
+_SEL_USER_BY_ID = _select(User).options(selectinload(User.weight_logs)).where(User.id == bindparam("uid"))
+# sem os logs de peso (auth e demais chamadores que não os usam)
+_SEL_USER_BY_NAME_NO_LOGS = _select(User).where(User.username == bindparam("uname"))
+_SEL_USER_BY_ID_NO_LOGS = _select(User).where(User.id == bindparam("uid"))
+
+# Caches em memória (usuários, histórico de chat, prompt da Lina): o deploy é um único
+# processo uvicorn (sem --workers), então quem escreve invalida aqui mesmo e basta. Com
+# vários workers estes caches precisariam de invalidação entre processos.
+#
+# Cache curto de usuários (auth/chat consultam o perfil em quase toda request);
+# valor = (dict, tem_weight_logs). Escritas pela app invalidam na hora; mudanças feitas
+# fora dela (SQL direto, scripts) aparecem em até USER_CACHE_TTL_S. Isso inclui has_access:
+# revogar acesso direto no banco leva até esse tempo para o /me refletir.
+_USER_CACHE_TTL_S = int(os.getenv("USER_CACHE_TTL_S", "30"))
+_user_cache: TTLCache = TTLCache(maxsize=1024, ttl=_USER_CACHE_TTL_S)
+_user_id_cache: TTLCache = TTLCache(maxsize=1024, ttl=_USER_CACHE_TTL_S)
+_user_cache_lock = threading.Lock()
+
+def _cache_user(data: Dict[str, Any], load_logs: bool) -> None:
+    entry = (data, load_logs)
+    with _user_cache_lock:
+        _user_cache[data["username"]] = entry
+        _user_id_cache[str(data["id"])] = entry
+
+# caches derivados do perfil (ex.: prompt da Lina) se registram aqui;
+# recebem o username ou None quando só o id é conhecido (limpar tudo)
+_invalidation_hooks: List[Callable[[Optional[str]], None]] = []
+
+def registrar_invalidacao_usuario(fn: Callable[[Optional[str]], None]) -> None:
+    _invalidation_hooks.append(fn)
+
+def invalidar_cache_usuario(username: Optional[str] = None, user_id: Optional[str] = None) -> None:
+    """Remove o usuário do cache; chamar após qualquer escrita em `users`."""
+    with _user_cache_lock:
+        if username:
+            cached = _user_cache.pop(username, None)
+            if cached:
+                _user_id_cache.pop(str(cached[0]["id"]), None)
+        if user_id:
+            cached = _user_id_cache.pop(str(user_id), None)
+            if cached:
+                _user_cache.pop(cached[0]["username"], None)
+                username = username or cached[0]["username"]
+    for fn in _invalidation_hooks:
+        fn(username)
+
+def _buscar_usuario_cached(cache: TTLCache, key: str, stmt, params: Dict[str, Any], load_logs: bool) -> Optional[Dict[str, Any]]:
+    with _user_cache_lock:
+        cached = cache.get(key)
+    if cached is not None and (cached[1] or not load_logs):
+        return dict(cached[0])
     with session_scope() as db:
-        u = db.execute(_select(User).where(User.username == username)).scalar_one_or_none()
-        return _user_to_dict(u) if u else None
-
-def buscar_usuario_by_id(user_id: str) -> Optional[Dict[str, Any]]:
-    with session_scope() as db:
-        u = db.execute(_select(User).where(User.id == user_id)).scalar_one_or_none()
-        return _user_to_dict(u) if u else None
+        u = db.execute(stmt, params).scalar_one_or_none()
+        if not u:
+            return None
+        data = _user_to_dict(u, load_logs=load_logs)
+    _cache_user(data, load_logs)
+    return dict(data)
+
+def buscar_usuario(username: str, load_logs: bool = True) -> Optional[Dict[str, Any]]:
+    """Usuário como dict; com load_logs=False `weight_logs` vem vazio e a query dos logs é pulada."""
+    stmt = _SEL_USER_BY_NAME if load_logs else _SEL_USER_BY_NAME_NO_LOGS
+    return _buscar_usuario_cached(_user_cache, username, stmt, {"uname": username}, load_logs)
+
+def buscar_usuario_em_cache(username: str) -> Optional[Dict[str, Any]]:
+    """Como buscar_usuario(load_logs=False), mas só memória (None se não estiver em cache): seguro no event loop."""
+    with _user_cache_lock:
+        cached = _user_cache.get(username)
+    return dict(cached[0]) if cached is not None else None
+
+def buscar_usuario_by_id(user_id: str, load_logs: bool = True) -> Optional[Dict[str, Any]]:
+    stmt = _SEL_USER_BY_ID if load_logs else _SEL_USER_BY_ID_NO_LOGS
+    return _buscar_usuario_cached(_user_id_cache, str(user_id), stmt, {"uid": user_id}, load_logs)
+
+# colunas copiadas direto do dict; as demais têm alias/coerção em _defaults_para_insercao
+_USER_COLUMNS = (
+    "nome", "objetivo", "sex", "age", "height_cm", "initial_weight", "current_weight",
+    "activity_level", "goal_type", "pace_kg_per_week", "avatar_url",
+)
 
 def _defaults_para_insercao(user: Dict[str, Any]) -> Dict[str, Any]:
-    return {
-        "username": user["username"],
-        "password_hash": user.get("password") or user.get("password_hash"),
-        "nome": user.get("nome"),
-        "objetivo": user.get("objetivo"),
-        "sex": user.get("sex"),
-        "age": user.get("age"),
-        "height_cm": user.get("height_cm"),
-        "initial_weight": user.get("initial_weight"),
-        "current_weight": user.get("current_weight"),
-        "activity_level": user.get("activity_level"),
-        "goal_type": user.get("goal_type"),
-        "pace_kg_per_week": user.get("pace_kg_per_week"),
-        "restrictions": user.get("restrictions") or [],
-        "confirm_low_calorie": bool(user.get("confirm_low_calorie", False)),
-        "has_access": bool(user.get("has_access", False)),
-        "is_admin": bool(user.get("is_admin", False)),
-        "avatar_url": user.get("avatar_url"),
-    }
+    values = {k: user.get(k) for k in _USER_COLUMNS}
+    values.update(
+        username=user["username"],
+        password_hash=user.get("password") or user.get("password_hash"),
+        restrictions=user.get("restrictions") or [],
+        confirm_low_calorie=bool(user.get("confirm_low_calorie", False)),
+        has_access=bool(user.get("has_access", False)),
+        is_admin=bool(user.get("is_admin", False)),
+    )
+    return values
+
+def _parse_ts(item: Dict[str, Any]) -> datetime:
+    ts = item.get("recorded_at")
+    return datetime.fromisoformat(ts) if isinstance(ts, str) else (ts or _utcnow())
 
 def salvar_usuario(user: Dict[str, Any]) -> None:
     if "username" not in user:
         raise ValueError("salvar_usuario: campo 'username' é obrigatório")
+    values = _defaults_para_insercao(user)
+    # UPSERT atômico: uma ida ao banco, sem SELECT + insert/update em Python
+    stmt = pg_insert(User).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.username],
+        set_={k: stmt.excluded[k] for k, v in values.items() if k != "username" and v is not None},
+    ).returning(User.id)
     with session_scope() as db:
-        u = db.execute(_select(User).where(User.username == user["username"])).scalar_one_or_none()
-        if not u:
-            u = User(**_defaults_para_insercao(user))
-            db.add(u)
-            db.flush()
-        else:
-            for k, v in _defaults_para_insercao(user).items():
-                if v is not None:
-                    setattr(u, k, v)
+        user_id = db.execute(stmt).scalar_one()
 
+        payload = []
         for item in user.get("weight_logs", []) or []:
             try:
-                ts = item.get("recorded_at")
-                dt = datetime.fromisoformat(ts) if isinstance(ts, str) else (ts or datetime.utcnow())
-                wl = WeightLog(user_id=u.id, weight=float(item["weight"]), recorded_at=dt)
-                db.add(wl)
+                payload.append({"user_id": user_id, "weight": float(item["weight"]), "recorded_at": _parse_ts(item)})
             except Exception:
                 continue
+        if payload:
+            db.execute(insert(WeightLog), payload)
+    invalidar_cache_usuario(user["username"])
+
+# UPDATE único para qualquer combinação de campos (NULL = mantém o valor atual):
+# SQL constante, então o prepared statement da conexão é reaproveitado
+_PROFILE_FIELDS = ("sex","age","height_cm","current_weight","activity_level","goal_type","pace_kg_per_week","restrictions","confirm_low_calorie")
+
+def _patch_param(k: str):
+    col = User.__table__.c[k]
+    # JSONB padrão serializa None como 'null' (não NULL), o que anularia o COALESCE
+    type_ = JSONB(none_as_null=True) if k == "restrictions" else col.type
+    return func.coalesce(cast(bindparam(f"p_{k}", type_=type_), col.type), col)
+
+_PATCH_PROFILE = (
+    update(User)
+    .where(User.username == bindparam("uname"))
+    .values({k: _patch_param(k) for k in _PROFILE_FIELDS})
+    .returning(User.id)
+)
+
+def atualizar_perfil(username: str, campos: Dict[str, Any]) -> bool:
+    """Atualiza os campos de perfil presentes em `campos`; False se o usuário não existe."""
+    if not any(campos.get(k) is not None for k in _PROFILE_FIELDS):
+        return True
+    params = {f"p_{k}": campos.get(k) for k in _PROFILE_FIELDS}
+    params["uname"] = username
+    with ENGINE.begin() as conn:
+        found = conn.execute(_PATCH_PROFILE, params).first() is not None
+    invalidar_cache_usuario(username)
+    return found
+
+_SEL_PROFILE = _select(*(User.__table__.c[k] for k in _PROFILE_FIELDS), User.objetivo).where(
+    User.username == bindparam("uname")
+)
+
+def buscar_perfil(username: str) -> Optional[Dict[str, Any]]:
+    """Colunas do perfil nutricional (+ objetivo legado), sem normalização; None se não existe."""
+    with ENGINE.connect() as conn:
+        row = conn.execute(_SEL_PROFILE, {"uname": username}).mappings().first()
+    return dict(row) if row is not None else None
 
 async def grant_user_access(user_id: str) -> None:
+    # UPDATE único e atômico (sem SELECT + flush do objeto ORM)
     with session_scope() as db:
-        u = db.execute(_select(User).where(User.id == user_id)).scalar_one_or_none()
-        if not u:
+        found = db.execute(
+            update(User).where(User.id == user_id).values(has_access=True).returning(User.id)
+        ).scalar_one_or_none()
+        if found is None:
             raise ValueError(f"Usuário '{user_id}' não encontrado no DB")
-        u.has_access = True
+    invalidar_cache_usuario(user_id=str(user_id))
+
+# =========================
+# Escrita de chat / refeições
+# =========================
+# Síncrona: quando a função retorna, o turno já está commitado (um INSERT multi-linha).
+# Endpoints async chamam via asyncio.to_thread; falha do banco sobe para quem chamou.
+_CHAT_ROLES = ("user", "assistant", "bot")
+_MSG_TYPES = ("text", "image")
+
+# username -> users.id dos autores de mensagens (o id de um username nunca muda)
+_author_ids: TTLCache = TTLCache(maxsize=4096, ttl=300)
+
+def _resolve_user_id(db, username: str):
+    """users.id do username, criando o usuário se ainda não existe (mesmo comportamento do insert unitário)."""
+    uid = _author_ids.get(username)
+    if uid is None:
+        # get-or-create em um único statement: o DO UPDATE no-op faz o RETURNING
+        # devolver também a linha que já existia
+        stmt = pg_insert(User).values(username=username)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.username],
+            set_={"username": stmt.excluded.username},
+        ).returning(User.id)
+        uid = db.execute(stmt).scalar_one()
+    return uid
+
+def _render_chat(role: str, text_: str, type_: Optional[str],
+                 image_url: Optional[str], created_at: datetime) -> Dict[str, Any]:
+    # já no formato de resposta do /chat/history (o endpoint devolve os dicts como estão)
+    return {
+        "role": role,
+        "text": text_,
+        "type": type_ or "text",
+        "imageUrl": image_url,
+        "created_at": created_at.isoformat(),
+    }
+
+# Últimas N mensagens por usuário (write-through): salvar_chat_messages acrescenta após o commit,
+# buscar_chat_history só vai ao banco na primeira leitura ou se pedir mais que N.
+_CHAT_RECENT_MAX = 50
+_chat_recent: LRUCache = LRUCache(maxsize=1024)
+_chat_cache_lock = threading.Lock()
+_chat_writes = 0  # contador global; evita popular o cache com leitura concorrente a uma escrita
 
 def salvar_chat_message(username: str, role: str, text_: str, msg_type: str = "text") -> None:
+    salvar_chat_messages(username, [(role, text_, msg_type)])
+
+def salvar_chat_messages(username: str, mensagens: List[Tuple[str, str, str]]) -> None:
+    """Grava (role, texto, type) de um mesmo turno num único INSERT multi-linha, já commitado."""
+    global _chat_writes
+    for role, _, msg_type in mensagens:
+        if role not in _CHAT_ROLES:
+            raise ValueError(f"role inválido: {role!r}")
+        if msg_type not in _MSG_TYPES:
+            raise ValueError(f"type inválido: {msg_type!r}")
+    rows = [
+        {
+            "id": _uuid7(),
+            "role": role,
+            "text": text_,
+            "type": msg_type,
+            "created_at": _utcnow(),
+        }
+        for role, text_, msg_type in mensagens
+    ]
     with session_scope() as db:
-        u = db.execute(_select(User).where(User.username == username)).scalar_one_or_none()
-        if not u:
-            u = User(username=username)
-            db.add(u)
-            db.flush()
-        msg = ChatMessage(user_id=u.id, role=role, text=text_, type=msg_type)
-        db.add(msg)
+        uid = _resolve_user_id(db, username)
+        db.execute(insert(ChatMessage), [{**r, "user_id": uid} for r in rows])
+    # só depois do commit: um id criado numa transação que deu rollback não existe
+    _author_ids[username] = uid
+    with _chat_cache_lock:
+        _chat_writes += 1
+        recent = _chat_recent.get(username)
+        if recent is not None:
+            recent.extend(
+                _render_chat(r["role"], r["text"], r["type"], None, r["created_at"]) for r in rows
+            )
+
+# tuplas Core (sem hidratar objetos ORM só para virar dict); statement montado uma vez,
+# o join com users evita um round-trip só para achar o id
+_SEL_CHAT_RECENT = (
+    _select(ChatMessage.role, ChatMessage.text, ChatMessage.type, ChatMessage.image_url, ChatMessage.created_at)
+    .join(User, User.id == ChatMessage.user_id)
+    .where(User.username == bindparam("uname"))
+    .order_by(ChatMessage.created_at.desc())
+    .limit(bindparam("lim"))
+)
+
+def _query_chat_history(username: str, limit: int) -> List[Dict[str, Any]]:
+    # leitura Core pura: conexão do pool direto, sem Session/unit of work
+    with ENGINE.connect() as conn:
+        rows = conn.execute(_SEL_CHAT_RECENT, {"uname": username, "lim": limit}).all()
+    return [_render_chat(*r) for r in reversed(rows)]
+
+def buscar_chat_history_em_cache(username: str, limit: int = 10) -> Optional[List[Dict[str, Any]]]:
+    """Como buscar_chat_history, mas só memória (None se não estiver em cache): seguro no event loop."""
+    if limit > _CHAT_RECENT_MAX:
+        return None
+    with _chat_cache_lock:
+        recent = _chat_recent.get(username)
+        if recent is None:
+            return None
+        return list(islice(reversed(recent), 0, limit))[::-1]
 
 def buscar_chat_history(username: str, limit: int = 10) -> List[Dict[str, Any]]:
-    with session_scope() as db:
-        u = db.execute(_select(User).where(User.username == username)).scalar_one_or_none()
-        if not u:
-            return []
-        rows = (
-            db.execute(
-                _select(ChatMessage)
-                .where(ChatMessage.user_id == u.id)
-                .order_by(ChatMessage.created_at.desc())
-                .limit(limit)
-            )
-            .scalars()
-            .all()
-        )
-        rows = list(reversed(rows))
-        return [
-            {
-                "username": username,
-                "role": r.role,
-                "text": r.text,
-                "type": r.type or "text",
-                "imageUrl": r.image_url,
-                "created_at": r.created_at.isoformat(),
-            }
-            for r in rows
-        ]
+    """Últimas `limit` mensagens, da mais antiga para a mais recente; sempre dicts de _render_chat."""
+    if limit <= 0:
+        return []
+    if limit > _CHAT_RECENT_MAX:
+        return _query_chat_history(username, limit)
+    with _chat_cache_lock:
+        recent = _chat_recent.get(username)
+        if recent is not None:
+            return list(islice(reversed(recent), 0, limit))[::-1]
+        gen = _chat_writes
+    history = _query_chat_history(username, _CHAT_RECENT_MAX)
+    with _chat_cache_lock:
+        # escrita commitada durante o SELECT pode ter ficado de fora: não cacheia
+        if _chat_writes == gen:
+            _chat_recent[username] = deque(history, maxlen=_CHAT_RECENT_MAX)
+    return history[-limit:]
 
 def salvar_meal_analysis(username: str, analise: Dict[str, Any], imagem_nome: Optional[str] = None) -> None:
+    """Grava a análise já commitada (síncrona, como salvar_chat_messages)."""
     with session_scope() as db:
-        u = db.execute(_select(User).where(User.username == username)).scalar_one_or_none()
-        if not u:
-            u = User(username=username)
-            db.add(u)
-            db.flush()
-        meal = MealAnalysis(user_id=u.id, analysis=analise, image_name=imagem_nome)
-        db.add(meal)
+        uid = _resolve_user_id(db, username)
+        db.execute(insert(MealAnalysis), {
+            "id": _uuid7(),
+            "user_id": uid,
+            "analysis": analise,
+            "image_name": imagem_nome,
+            "created_at": _utcnow(),
+        })
+    _author_ids[username] = uid
+
+# Resumo da análise montado no Postgres: só as chaves usadas na listagem trafegam,
+# o JSONB completo fica para buscar_meal_detail. A análise de imagem é texto livre
+# (JSONB string, sem totais/items): essa vai inteira em vez de virar {totais: null, ...}.
+MEAL_SUMMARY = case(
+    (
+        func.jsonb_typeof(MealAnalysis.analysis) == "object",
+        func.jsonb_build_object(
+            "totais", MealAnalysis.analysis["totais"],
+            "items", MealAnalysis.analysis["items"],
+            type_=JSONB,
+        ),
+    ),
+    else_=MealAnalysis.analysis,
+).label("analysis")
+
+def _sel_meals(analysis_col):
+    return (
+        _select(MealAnalysis.id, MealAnalysis.image_name, MealAnalysis.created_at, analysis_col)
+        .join(User, User.id == MealAnalysis.user_id)
+        .where(User.username == bindparam("uname"))
+        .order_by(MealAnalysis.created_at.desc())
+        .limit(bindparam("lim"))
+    )
+
+_SEL_MEAL_SUMMARIES = _sel_meals(MEAL_SUMMARY)
+_SEL_MEALS_FULL = _sel_meals(MealAnalysis.analysis)
+_SEL_MEAL_DETAIL = (
+    _select(MealAnalysis.id, MealAnalysis.analysis, MealAnalysis.image_name, MealAnalysis.created_at)
+    .join(User, User.id == MealAnalysis.user_id)
+    .where(User.username == bindparam("uname"), MealAnalysis.id == bindparam("mid"))
+)
 
-def buscar_meal_history(username: str, limit: int = 10) -> List[Dict[str, Any]]:
+def buscar_meal_history(username: str, limit: int = 10, completo: bool = False) -> List[Dict[str, Any]]:
+    """Refeições mais recentes; `analise` traz só o resumo (totais/items), exceto com completo=True."""
+    stmt = _SEL_MEALS_FULL if completo else _SEL_MEAL_SUMMARIES
     with session_scope() as db:
-        u = db.execute(_select(User).where(User.username == username)).scalar_one_or_none()
-        if not u:
-            return []
-        rows = (
-            db.execute(
-                _select(MealAnalysis)
-                .where(MealAnalysis.user_id == u.id)
-                .order_by(MealAnalysis.created_at.desc())
-                .limit(limit)
-            )
-            .scalars()
-            .all()
-        )
+        rows = db.execute(stmt, {"uname": username, "lim": limit}).all()
         return [
             {
+                "id": str(meal_id),
                 "usuario": username,
-                "analise": r.analysis,
-                "imagem_nome": r.image_name,
-                "data": r.created_at.isoformat(),
+                "analise": analysis or {},
+                "imagem_nome": image_name,
+                "data": created_at.isoformat(),
             }
-            for r in rows
+            for meal_id, image_name, created_at, analysis in rows
         ]
+
+def buscar_meal_detail(username: str, meal_id: str) -> Optional[Dict[str, Any]]:
+    with session_scope() as db:
+        row = db.execute(_SEL_MEAL_DETAIL, {"uname": username, "mid": meal_id}).first()
+        if not row:
+            return None
+        return {
+            "id": str(row.id),
+            "usuario": username,
+            "analise": row.analysis or {},
+            "imagem_nome": row.image_name,
+            "data": row.created_at.isoformat(),
+        }
@@ -1,54 +1,39 @@
 # app/endpoints/chat.py
 import os
 import re
-import json
+import asyncio
+import logging
+import unicodedata
 from datetime import datetime, timezone, date
+from functools import lru_cache
+from typing import Awaitable, Callable, Optional
+
+import anyio
+import orjson
 import openai
+from cachetools import TTLCache
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from openai import OpenAI
 from app.auth import get_current_username
-from app.db import salvar_chat_message, buscar_chat_history, buscar_usuario
-from app.services.lina_context import build_lina_system_prompt
-
-# DB helpers (perfil + intake diário)
-try:
-    import psycopg2
-    import psycopg2.extras
-except ImportError as e:
-    raise RuntimeError("psycopg2 não encontrado. Adicione 'psycopg2-binary' ao requirements.txt") from e
-
-def _dsn_from_env() -> dict:
-    url = os.getenv("DATABASE_URL")
-    if url:
-        return {"dsn": url}
-    return {
-        "host": os.getenv("PGHOST") or os.getenv("DB_HOST") or "127.0.0.1",
-        "port": int(os.getenv("PGPORT") or 5432),
-        "dbname": os.getenv("PGDATABASE") or os.getenv("DB_NAME") or "nutriflow",
-        "user": os.getenv("PGUSER") or os.getenv("DB_USER") or "nutriflow_user",
-        "password": os.getenv("PGPASSWORD") or os.getenv("DB_PASSWORD") or None,
-    }
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
 
-def _get_conn():
-    cfg = _dsn_from_env()
-    if "dsn" in cfg:
-        return psycopg2.connect(cfg["dsn"], sslmode=os.getenv("PGSSLMODE","prefer"))
-    return psycopg2.connect(**cfg)
+from app.db import ENGINE, atualizar_perfil, salvar_chat_message, salvar_chat_messages, buscar_chat_history, buscar_chat_history_em_cache, buscar_usuario
+from app.services.openai_client import OPENAI_API_KEY, get_openai
+from app.services.lina_context import build_lina_system_prompt, get_targets_ctx, lina_prompt_em_cache
+
+logger = logging.getLogger(__name__)
 
 def _today_utc() -> date:
     return datetime.now(timezone.utc).date()
 
-# OpenAI
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    print("❌ ERRO: OPENAI_API_KEY não está definida no .env")
-else:
-    print(f"✅ OpenAI API Key encontrada: {api_key[:10]}...")
-client = OpenAI(api_key=api_key)
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+CHAT_MODEL_ANALYZE = os.getenv("CHAT_MODEL_ANALYZE", "gpt-4o-mini")
 
 router = APIRouter(tags=["chat"])
 
+@lru_cache(maxsize=2048)
 def get_lina_chat_prompt(username: str, nome: str | None = None) -> str:
     nome_exibicao = nome if nome else username
     return f"""Você é a Lina, assistente nutricional da NutriFlow. Você está conversando com {nome_exibicao} ({username}).
@@ -79,7 +64,8 @@ class ChatHistoryResponse(BaseModel):
     history: list
 
 # ---------- /perfil: parser e update ----------
-_ALLOWED_ACTIVITY = {1.2, 1.375, 1.55, 1.725, 1.9}
+_ALLOWED_ACTIVITY = frozenset({1.2, 1.375, 1.55, 1.725, 1.9})
+_ALLOWED_ACTIVITY_SORTED = tuple(sorted(_ALLOWED_ACTIVITY))
 _KEY_MAP = {
     "sex": "sex",
     "sexo": "sex",
@@ -105,41 +91,79 @@ _KEY_MAP = {
     "confirm_low_calorie": "confirm_low_calorie",
 }
 
-def _parse_perfil_cmd(text: str) -> dict:
-    body = text.strip().split(None, 1)
-    if len(body) < 2:
-        return {}
-    args = body[1]
-    parts = re.findall(r'(\w+)\s*=\s*("[^"]+"|\'[^\']+\'|[^ \t]+)', args)
+# regex compiladas uma vez (comandos /perfil e /consumo)
+# valor entre aspas duplas, simples ou sem aspas: cada forma num grupo, aspas fora da captura
+_PERFIL_RE = re.compile(r'(\w+)\s*=\s*(?:"([^"]+)"|\'([^\']+)\'|([^ \t]+))')
+_KCAL_ONLY_RE = re.compile(r"[+]?\d+(\.\d+)?")
+_CONSUMO_RE = re.compile(r'(\w+)\s*=\s*([+\-]?\d+(?:\.\d+)?)')
+# alias -> posição em (kcal, p, c, f)
+_CONSUMO_KEYS = {
+    **dict.fromkeys(("kcal","cal","calorias"), 0),
+    **dict.fromkeys(("p","prot","proteina","proteína","protein","protein_g"), 1),
+    **dict.fromkeys(("c","carb","carbo","carboidrato","carboidratos","carbs_g"), 2),
+    **dict.fromkeys(("f","fat","gordura","gorduras","fat_g"), 3),
+}
+
+# conversores por campo: valor inválido -> None (campo ignorado)
+def _to_int(v: str) -> Optional[int]:
+    try:
+        return int(v)
+    except ValueError:
+        return None
+
+def _to_float(v: str) -> Optional[float]:
+    try:
+        return float(v)
+    except ValueError:
+        return None
+
+def _to_list(v: str) -> list[str]:
+    return [t for s in v.split(",") if (t := s.strip())]
+
+def _to_bool(v: str) -> bool:
+    return v.lower() in ("1","true","t","yes","sim","y")
+
+def _to_goal(v: str) -> Optional[str]:
+    val = v.lower()
+    if val in ("lose","maintain","gain"):
+        return val
+    if val.startswith("perd"):
+        return "lose"
+    if val.startswith("mant"):
+        return "maintain"
+    if val.startswith("ganh") or "massa" in val:
+        return "gain"
+    return None
+
+def _to_sex(v: str) -> Optional[str]:
+    up = v.upper()
+    return up if up in ("M","F") else None
+
+_CONVERTERS = {
+    "sex": _to_sex,
+    "age": _to_int,
+    "height_cm": _to_float,
+    "current_weight": _to_float,
+    "activity_level": _to_float,
+    "goal_type": _to_goal,
+    "pace_kg_per_week": _to_float,
+    "restrictions": _to_list,
+    "confirm_low_calorie": _to_bool,
+}
+# alias digitado -> (campo canônico, conversor): um único lookup por par chave=valor
+_PERFIL_FIELDS = {alias: (key, _CONVERTERS[key]) for alias, key in _KEY_MAP.items()}
+
+def _parse_perfil_cmd(args: str) -> dict:
+    """args = texto após '/perfil' (já separado pelo _handle_command)."""
     out = {}
-    for k, v in parts:
-        k = k.strip().lower()
-        v = v.strip().strip("'").strip('"')
-        key = _KEY_MAP.get(k)
-        if not key:
+    for k, dq, sq, bare in _PERFIL_RE.findall(args):
+        field = _PERFIL_FIELDS.get(k.lower())
+        if field is None:
             continue
-        if key in ("age",):
-            try: out[key] = int(v)
-            except: pass
-        elif key in ("height_cm","current_weight","activity_level","pace_kg_per_week"):
-            try: out[key] = float(v)
-            except: pass
-        elif key == "restrictions":
-            out[key] = [s.strip() for s in v.split(",") if s.strip()]
-        elif key == "confirm_low_calorie":
-            out[key] = v.lower() in ("1","true","t","yes","sim","y")
-        elif key == "goal_type":
-            val = v.lower()
-            if val in ("lose","maintain","gain"):
-                out[key] = val
-            elif val.startswith("perd"): out[key] = "lose"
-            elif val.startswith("mant"): out[key] = "maintain"
-            elif val.startswith("ganh") or "massa" in val: out[key] = "gain"
-        elif key == "sex":
-            up = v.upper()
-            if up in ("M","F"): out[key] = up
-        else:
-            out[key] = v
+        key, conv = field
+        val = conv((dq or sq or bare.strip("'\"")).strip())
+        if val is not None:
+            out[key] = val
     return out
 
 def _validate_profile_patch(p: dict):
@@ -150,7 +174,7 @@ def _validate_profile_patch(p: dict):
     if "current_weight" in p and not (25 <= float(p["current_weight"]) <= 400):
         raise HTTPException(422, "current_weight deve estar entre 25 e 400.")
     if "activity_level" in p and float(p["activity_level"]) not in _ALLOWED_ACTIVITY:
-        raise HTTPException(422, f"activity_level deve ser um de {sorted(_ALLOWED_ACTIVITY)}.")
+        raise HTTPException(422, f"activity_level deve ser um de {list(_ALLOWED_ACTIVITY_SORTED)}.")
     if "pace_kg_per_week" in p and not (0.10 <= float(p["pace_kg_per_week"]) <= 1.50):
         raise HTTPException(422, "pace_kg_per_week deve estar entre 0.10 e 1.50.")
     if "restrictions" in p and not all(isinstance(x, str) for x in p["restrictions"]):
@@ -160,70 +184,61 @@ def _validate_profile_patch(p: dict):
     if "goal_type" in p and p["goal_type"] not in ("lose","maintain","gain"):
         raise HTTPException(422, "goal_type deve ser 'lose', 'maintain' ou 'gain'.")
 
-def _patch_profile(username: str, p: dict):
-    if not p:
-        return
-    fields, vals = [], []
-    for k in ("sex","age","height_cm","current_weight","activity_level","goal_type","pace_kg_per_week","restrictions","confirm_low_calorie"):
-        if k in p:
-            if k == "restrictions":
-                vals.append(psycopg2.extras.Json(p[k]))
-            else:
-                vals.append(p[k])
-            fields.append(f"{k} = %s")
-    if not fields:
-        return
-    vals.append(username)
-    sql = f"UPDATE public.users SET {', '.join(fields)} WHERE username = %s"
-    with _get_conn() as conn, conn.cursor() as cur:
-        cur.execute(sql, vals)
-
 # ---------- intake diário ----------
-def _upsert_intake(username: str, kcal: float, p: float, c: float, f: float):
-    """Soma nos contadores do dia (UTC)."""
-    d = _today_utc()
-    with _get_conn() as conn, conn.cursor() as cur:
-        cur.execute("""
-            INSERT INTO public.daily_intake (username, day, kcal, protein_g, carbs_g, fat_g)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (username, day) DO UPDATE SET
-              kcal = public.daily_intake.kcal + EXCLUDED.kcal,
-              protein_g = public.daily_intake.protein_g + EXCLUDED.protein_g,
-              carbs_g = public.daily_intake.carbs_g + EXCLUDED.carbs_g,
-              fat_g = public.daily_intake.fat_g + EXCLUDED.fat_g,
-              updated_at = now();
-        """, (username, d, float(kcal or 0), float(p or 0), float(c or 0), float(f or 0)))
-
-def _reset_intake(username: str):
-    d = _today_utc()
-    with _get_conn() as conn, conn.cursor() as cur:
-        cur.execute("""
-            INSERT INTO public.daily_intake (username, day, kcal, protein_g, carbs_g, fat_g)
-            VALUES (%s, %s, 0, 0, 0, 0)
-            ON CONFLICT (username, day) DO UPDATE SET
-              kcal = 0, protein_g = 0, carbs_g = 0, fat_g = 0, updated_at = now();
-        """, (username, d))
+# SQL fixo (sem montagem por chamada) nas conexões do pool do ENGINE
+_UPSERT_INTAKE = text("""
+    INSERT INTO public.daily_intake (username, day, kcal, protein_g, carbs_g, fat_g)
+    VALUES (:u, :d, :kcal, :p, :c, :f)
+    ON CONFLICT (username, day) DO UPDATE SET
+      kcal = public.daily_intake.kcal + EXCLUDED.kcal,
+      protein_g = public.daily_intake.protein_g + EXCLUDED.protein_g,
+      carbs_g = public.daily_intake.carbs_g + EXCLUDED.carbs_g,
+      fat_g = public.daily_intake.fat_g + EXCLUDED.fat_g,
+      updated_at = now()
+    RETURNING kcal, protein_g, carbs_g, fat_g
+""")
+_RESET_INTAKE = text("""
+    INSERT INTO public.daily_intake (username, day, kcal, protein_g, carbs_g, fat_g)
+    VALUES (:u, :d, 0, 0, 0, 0)
+    ON CONFLICT (username, day) DO UPDATE SET
+      kcal = 0, protein_g = 0, carbs_g = 0, fat_g = 0, updated_at = now()
+""")
+_SELECT_INTAKE = text("""
+    SELECT kcal, protein_g, carbs_g, fat_g
+    FROM public.daily_intake
+    WHERE username = :u AND day = :d
+""")
+
+def _intake_dict(row) -> dict:
+    if not row:
+        return {"kcal": 0.0, "protein_g": 0.0, "carbs_g": 0.0, "fat_g": 0.0}
+    return {
+        "kcal": float(row[0] or 0),
+        "protein_g": float(row[1] or 0),
+        "carbs_g": float(row[2] or 0),
+        "fat_g": float(row[3] or 0),
+    }
+
+def _upsert_intake(username: str, kcal: float, p: float, c: float, f: float) -> dict:
+    """Soma nos contadores do dia (UTC) e devolve os totais atualizados (RETURNING, sem 2º SELECT)."""
+    with ENGINE.begin() as conn:
+        row = conn.execute(_UPSERT_INTAKE, {
+            "u": username, "d": _today_utc(),
+            "kcal": float(kcal or 0), "p": float(p or 0), "c": float(c or 0), "f": float(f or 0),
+        }).first()
+    return _intake_dict(row)
+
+def _reset_intake(username: str) -> dict:
+    with ENGINE.begin() as conn:
+        conn.execute(_RESET_INTAKE, {"u": username, "d": _today_utc()})
+    return _intake_dict(None)
 
 def _get_intake(username: str) -> dict:
-    d = _today_utc()
-    with _get_conn() as conn, conn.cursor() as cur:
-        cur.execute("""
-            SELECT kcal, protein_g, carbs_g, fat_g
-            FROM public.daily_intake
-            WHERE username = %s AND day = %s
-        """, (username, d))
-        row = cur.fetchone()
-        if not row:
-            return {"kcal": 0.0, "protein_g": 0.0, "carbs_g": 0.0, "fat_g": 0.0}
-        return {
-            "kcal": float(row[0] or 0),
-            "protein_g": float(row[1] or 0),
-            "carbs_g": float(row[2] or 0),
-            "fat_g": float(row[3] or 0),
-        }
+    with ENGINE.connect() as conn:
+        return _intake_dict(conn.execute(_SELECT_INTAKE, {"u": username, "d": _today_utc()}).first())
 
 def _format_status(cons: dict, targets_ctx: dict | None) -> str:
-    # targets_ctx é o retorno do GET /api/nutrition/targets embutido no build_lina_system_prompt
+    # targets_ctx é o retorno de get_targets_ctx ({"profile", "targets"})
     t = (targets_ctx or {}).get("targets") or {}
     trg = t.get("targets") or t  # compat ambas formas
     tkcal = float(trg.get("kcal") or 0)
@@ -252,57 +267,101 @@ def _format_status(cons: dict, targets_ctx: dict | None) -> str:
     return "\n".join(linhas)
 
 # ---------- /refeicao (texto) ----------
-_MEAL_JSON_INSTRUCTIONS = """Responda APENAS com um JSON válido, sem explicações.
-Formato:
-{
-  "items": [{"nome": "string", "quantidade": "string"}],
-  "totais": {"kcal": number, "protein_g": number, "carbs_g": number, "fat_g": number},
-  "dica": "string curta"
-}
+_MEAL_JSON_INSTRUCTIONS = """Extraia os alimentos e estime os macros da refeição descrita.
 Regras:
 - Use estimativas conservadoras.
 - Proteína/gordura/carboidrato em gramas; kcal em calorias.
 - Se descrição for vaga, suponha porções comuns.
+- "dica" é uma dica curta.
 """
 
-def _analyze_meal_text(description: str) -> dict:
-    resp = client.chat.completions.create(
-        model=os.getenv("CHAT_MODEL_ANALYZE", "gpt-4o-mini"),
+# structured outputs: a API garante JSON válido com exatamente estas chaves
+_MEAL_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "analise_refeicao",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "items": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"nome": {"type": "string"}, "quantidade": {"type": "string"}},
+                        "required": ["nome", "quantidade"],
+                        "additionalProperties": False,
+                    },
+                },
+                "totais": {
+                    "type": "object",
+                    "properties": {k: {"type": "number"} for k in ("kcal", "protein_g", "carbs_g", "fat_g")},
+                    "required": ["kcal", "protein_g", "carbs_g", "fat_g"],
+                    "additionalProperties": False,
+                },
+                "dica": {"type": "string"},
+            },
+            "required": ["items", "totais", "dica"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# A extração de macros não depende do usuário: mesma descrição, mesma resposta.
+# Cache exato por descrição normalizada evita repetir a chamada à OpenAI. Guarda só o JSON
+# bruto (str, imutável): cada hit monta um dict novo, então quem recebe pode alterá-lo à vontade.
+_MEAL_CACHE_TTL_S = int(os.getenv("MEAL_CACHE_TTL_S", "86400"))
+_MEAL_CACHE: TTLCache = TTLCache(maxsize=2048, ttl=_MEAL_CACHE_TTL_S)
+# descrição maior que isso não entra no cache (chave e reuso improvável; memória limitada)
+_MEAL_CACHE_MAX_CHARS = 500
+
+def _meal_key(description: str) -> str:
+    """casefold + sem acentos + espaços colapsados ("Pão  com Ovo" == "pao com ovo")."""
+    nfkd = unicodedata.normalize("NFKD", description.casefold())
+    return " ".join("".join(c for c in nfkd if not unicodedata.combining(c)).split())
+
+def _parse_meal(raw: str) -> dict:
+    """JSON do modelo -> dict da refeição. ValueError/KeyError/TypeError se inválido."""
+    data = orjson.loads(raw)
+    totals = data["totais"]
+    return {
+        "items": data["items"],
+        "totais": {k: float(totals[k]) for k in ("kcal", "protein_g", "carbs_g", "fat_g")},
+        "dica": data["dica"],
+        "_raw": raw,
+    }
+
+async def _analyze_meal_text(description: str) -> dict:
+    key = _meal_key(description) if len(description) <= _MEAL_CACHE_MAX_CHARS else None
+    cached = _MEAL_CACHE.get(key) if key is not None else None
+    if cached is not None:
+        return _parse_meal(cached)
+    resp = await get_openai().chat.completions.create(
+        model=CHAT_MODEL_ANALYZE,
         messages=[
             {"role": "system", "content": "Você é uma nutricionista que extrai macros de refeições em texto."},
             {"role": "user", "content": f"{_MEAL_JSON_INSTRUCTIONS}\nDescrição: {description}"},
         ],
-        max_tokens=400,
+        response_format=_MEAL_RESPONSE_FORMAT,
+        max_tokens=300,  # JSON puro sem prosa; folga para ~15 itens antes de cortar o JSON
         temperature=0.2,
     )
-    raw = (resp.choices[0].message.content or "").strip()
+    raw = resp.choices[0].message.content or ""
     try:
-        if raw.startswith("```"):
-            raw = raw.strip("`")
-            idx = raw.find("{")
-            raw = raw[idx:] if idx >= 0 else raw
-        data = json.loads(raw)
-        itens = data.get("items") or []
-        totals = data.get("totais") or data.get("totals") or {}
-        dica = data.get("dica") or ""
-        return {
-            "items": itens,
-            "totais": {
-                "kcal": float(totals.get("kcal") or 0),
-                "protein_g": float(totals.get("protein_g") or totals.get("proteina_g") or 0),
-                "carbs_g": float(totals.get("carbs_g") or totals.get("carboidratos_g") or 0),
-                "fat_g": float(totals.get("fat_g") or totals.get("gorduras_g") or 0),
-            },
-            "dica": dica,
-            "_raw": raw,
-        }
-    except Exception:
+        # só falha em recusa ou resposta cortada por max_tokens
+        meal = _parse_meal(raw)
+    except (KeyError, TypeError, ValueError):  # orjson.JSONDecodeError é ValueError
+        logger.warning("Análise de refeição sem JSON válido (finish_reason=%s)", resp.choices[0].finish_reason)
         return {
             "items": [],
             "totais": {"kcal": 0.0, "protein_g": 0.0, "carbs_g": 0.0, "fat_g": 0.0},
             "dica": "",
             "_raw": raw,
         }
+    # só resposta válida entra no cache (o fallback zerado não)
+    if key is not None:
+        _MEAL_CACHE[key] = raw
+    return meal
 
 def _format_meal_reply(username: str, meal: dict, targets: dict | None, status_txt: str | None) -> str:
     itens = meal.get("items") or []
@@ -331,34 +390,208 @@ def _format_meal_reply(username: str, meal: dict, targets: dict | None, status_t
     return header + lista + macros + bloco_status + dica_txt
 
 # ---------- parser /consumo ----------
-def _parse_consumo(text: str) -> tuple[float, float, float, float]:
+def _parse_consumo(arg: str) -> tuple[float, float, float, float]:
     """
-    Suporta:
+    `arg` = texto após '/consumo'. Suporta:
       /consumo 1300
       /consumo kcal=700 p=50 c=80 f=20
     Retorna (kcal, p, c, f) — não negativos.
     """
-    body = text.strip().split(None, 1)
-    if len(body) == 1:
-        return (0.0, 0.0, 0.0, 0.0)
-    arg = body[1].strip()
-    if re.fullmatch(r"[+]?\d+(\.\d+)?", arg):
+    if _KCAL_ONLY_RE.fullmatch(arg):
         kcal = float(arg)
         return (max(0.0, kcal), 0.0, 0.0, 0.0)
     # pares chave=valor
-    kcal = p = c = f = 0.0
-    for k, v in re.findall(r'(\w+)\s*=\s*([+\-]?\d+(?:\.\d+)?)', arg):
-        k = k.lower()
-        val = max(0.0, float(v))
-        if k in ("kcal","cal","calorias"): kcal = val
-        elif k in ("p","prot","proteina","proteína","protein","protein_g"): p = val
-        elif k in ("c","carb","carbo","carboidrato","carboidratos","carbs_g"): c = val
-        elif k in ("f","fat","gordura","gorduras","fat_g"): f = val
-    return (kcal, p, c, f)
+    vals = [0.0, 0.0, 0.0, 0.0]
+    for k, v in _CONSUMO_RE.findall(arg):
+        i = _CONSUMO_KEYS.get(k.lower())
+        if i is not None:
+            vals[i] = max(0.0, float(v))
+    return tuple(vals)
+
+_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKENS", "1500"))
+# teto de mensagens; quem limita de fato é o orçamento. <= 50 é servido do cache de recentes
+_HISTORY_MAX_MSGS = int(os.getenv("CHAT_HISTORY_MAX", "30"))
+
+def _approx_tokens(text: str) -> int:
+    # ~4 caracteres por token em pt-BR/en; suficiente para orçamento (sem tiktoken)
+    return len(text) // 4 + 1
+
+def _system_prompt(username: str) -> str:
+    try:
+        sys_prompt, _ = build_lina_system_prompt(username)
+        return sys_prompt
+    except Exception as e:
+        logger.warning("Contexto da Lina indisponível (%s); usando prompt genérico", e)
+        # só o prompt genérico usa o nome: busca o usuário apenas neste caminho
+        user_data = buscar_usuario(username, load_logs=False)
+        return get_lina_chat_prompt(username, user_data.get("nome") if user_data else None)
+
+async def _lina_prompt(username: str) -> str:
+    # prompt pré-montado em cache sai direto no event loop; só o miss monta em thread (DB)
+    sys_prompt = lina_prompt_em_cache(username)
+    if sys_prompt is None:
+        sys_prompt = await asyncio.to_thread(_system_prompt, username)
+    return sys_prompt
+
+async def _recent_history(username: str, limit: int) -> list[dict]:
+    # cache quente responde direto no event loop; só o miss vai para thread (DB)
+    history = buscar_chat_history_em_cache(username, limit)
+    if history is None:
+        history = await asyncio.to_thread(buscar_chat_history, username, limit)
+    return history
+
+async def _lina_messages(username: str, txt: str) -> list[dict]:
+    """System prompt (perfil + metas) + últimas mensagens + mensagem atual."""
+    # prompt e histórico são leituras independentes: no cache miss, latência = max dos dois
+    sys_prompt, history = await asyncio.gather(
+        _lina_prompt(username),
+        _recent_history(username, _HISTORY_MAX_MSGS),
+    )
+
+    # histórico da mais recente para a mais antiga, até estourar o orçamento de tokens
+    budget = _HISTORY_TOKEN_BUDGET
+    recent: list[dict] = []
+    for msg in reversed(history):
+        content = msg["text"]
+        if not content:
+            continue
+        budget -= _approx_tokens(content)
+        if budget < 0:
+            break
+        recent.append({"role": "assistant" if msg["role"] == "bot" else msg["role"], "content": content})
+    recent.reverse()
+    return [{"role": "system", "content": sys_prompt}, *recent, {"role": "user", "content": txt}]
+
+# sem isso nginx/proxies acumulam o stream e o cliente recebe tudo de uma vez no fim
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def _sse(data: dict, event: Optional[str] = None) -> bytes:
+    # data em JSON: quebras de linha do texto não quebram o framing do SSE
+    head = f"event: {event}\n".encode() if event else b""
+    return head + b"data: " + orjson.dumps(data) + b"\n\n"
+
+# ---------- Comandos ----------
+_PERFIL_USAGE = ("Uso: /perfil sex=M age=30 height=180 weight=92 activity=1.55 "
+                 "goal=gain pace=0.5 restrictions=lactose,gluten confirm_low_calorie=true")
+_CONSUMO_USAGE = "Uso: `/consumo 1300` ou `/consumo kcal=700 p=50 c=80 f=20`"
+_REFEICAO_USAGE = "Uso: /refeicao <descrição da refeição> (ex: '/refeicao 150g frango grelhado, 1 xíc. arroz, salada')."
+
+# Cada handler recebe (username, texto após o comando) e devolve a resposta do bot.
+# Acesso ao banco (SQLAlchemy síncrono) vai para threads via asyncio.to_thread.
+async def _cmd_perfil(username: str, rest: str) -> str:
+    patch = _parse_perfil_cmd(rest)
+    if not patch:
+        return _PERFIL_USAGE
+
+    _validate_profile_patch(patch)
+    await asyncio.to_thread(atualizar_perfil, username, patch)
+
+    ctx = await asyncio.to_thread(get_targets_ctx, username)
+    t = ctx.get("targets") or {}
+    trg = t.get("targets") or {}
+    return (
+        "Perfil atualizado com sucesso! ✅\n\n"
+        f"Metas do dia:\n"
+        f"- Calorias: {int(trg.get('kcal', 0))} kcal\n"
+        f"- Proteínas: {int(trg.get('protein_g', 0))} g\n"
+        f"- Gorduras: {int(trg.get('fat_g', 0))} g\n"
+        f"- Carboidratos: {int(trg.get('carbs_g', 0))} g"
+    )
+
+async def _cmd_confirmar_kcal_baixa(username: str, rest: str) -> str:
+    await asyncio.to_thread(atualizar_perfil, username, {"confirm_low_calorie": True})
+    return "Confirmação registrada ✅. Metas abaixo do mínimo podem ser usadas."
+
+async def _cmd_revogar_kcal_baixa(username: str, rest: str) -> str:
+    await asyncio.to_thread(atualizar_perfil, username, {"confirm_low_calorie": False})
+    return "Confirmação revogada ✅. Vou respeitar os mínimos de segurança novamente."
+
+async def _cmd_limpar_dia(username: str, rest: str) -> str:
+    cons = await asyncio.to_thread(_reset_intake, username)
+    return "Dia zerado ✅\n\n" + await asyncio.to_thread(_status_text, username, cons)
+
+async def _cmd_status(username: str, rest: str) -> str:
+    return await asyncio.to_thread(_status_text, username)
+
+async def _cmd_consumo(username: str, rest: str) -> str:
+    kcal, p, c, f = _parse_consumo(rest)
+    if (kcal + p + c + f) <= 0:
+        return _CONSUMO_USAGE
+
+    cons = await asyncio.to_thread(_upsert_intake, username, kcal, p, c, f)
+    status_txt = await asyncio.to_thread(_status_text, username, cons)
+    return f"Consumo registrado ✅ (+{int(kcal)} kcal, +{int(p)}g P, +{int(c)}g C, +{int(f)}g G)\n\n{status_txt}"
+
+async def _cmd_refeicao(username: str, rest: str) -> str:
+    if not rest:
+        return _REFEICAO_USAGE
+
+    # contexto (DB) e análise (OpenAI) são independentes: latência = max dos dois
+    ctx, meal = await asyncio.gather(
+        asyncio.to_thread(get_targets_ctx, username),
+        _analyze_meal_text(rest),
+    )
+    t = meal.get("totais") or {}
+
+    cons = await asyncio.to_thread(
+        _upsert_intake,
+        username,
+        float(t.get("kcal") or 0),
+        float(t.get("protein_g") or 0),
+        float(t.get("carbs_g") or 0),
+        float(t.get("fat_g") or 0),
+    )
+    status_txt = _format_status(cons, ctx)
+    return _format_meal_reply(username, meal, ctx.get("targets"), status_txt)
+
+# Mesma semântica de antes da tabela: prefixo (startswith) na mensagem em minúsculas, testado
+# nesta ordem; a primeira entrada que casar vence. `anywhere` = alias aceito em qualquer posição
+# da mensagem (legado: "liberar_deficit", com ou sem "/").
+_COMMANDS: tuple[tuple[tuple[str, ...], tuple[str, ...], Callable[[str, str], Awaitable[str]]], ...] = (
+    (("/perfil",), (), _cmd_perfil),
+    (("/confirmar_kcal_baixa", "/liberar_kcal_baixa", "/confirmar_deficit"), ("liberar_deficit",),
+     _cmd_confirmar_kcal_baixa),
+    (("/revogar_kcal_baixa", "/revogar_deficit", "/bloquear_deficit"), (), _cmd_revogar_kcal_baixa),
+    (("/limpar_dia",), (), _cmd_limpar_dia),
+    (("/status",), (), _cmd_status),
+    (("/consumo",), (), _cmd_consumo),
+    (("/refeicao",), (), _cmd_refeicao),
+)
+
+async def _handle_command(username: str, message: str) -> Optional[str]:
+    """Executa os comandos /... e devolve a resposta do bot; None = conversa normal."""
+    txt = message.strip()
+    low = txt.lower()
+    for prefixes, anywhere, handler in _COMMANDS:
+        for prefix in prefixes:
+            if low.startswith(prefix):
+                # handler recebe o texto após o prefixo casado
+                return await handler(username, txt[len(prefix):].strip())
+        if any(a in low for a in anywhere):
+            return await handler(username, "")
+    return None
+
+def _status_text(username: str, cons: dict | None = None) -> str:
+    """`cons` = totais do dia já conhecidos (ex.: RETURNING do upsert); None = lê do banco."""
+    ctx = get_targets_ctx(username)
+    return _format_status(cons if cons is not None else _get_intake(username), ctx)
+
+def _erro_ia(e: Exception) -> HTTPException:
+    """Mesmo mapeamento de erro para /send e /send/stream."""
+    if isinstance(e, openai.AuthenticationError):
+        return HTTPException(502, "Erro de autenticação com OpenAI. Verifique a API key.")
+    if isinstance(e, openai.APIError):
+        return HTTPException(502, f"Erro da API OpenAI: {str(e)}")
+    if isinstance(e, SQLAlchemyError):
+        # ex.: turno não gravado; o cliente não deve achar que a conversa ficou salva
+        logger.exception("Erro de banco no chat")
+        return HTTPException(503, "Banco de dados indisponível. Tente novamente.")
+    logger.exception("Erro geral no chat: %s", type(e).__name__)
+    return HTTPException(502, f"Erro ao conectar com a IA: {str(e)}")
 
 # ---------- Endpoints ----------
 @router.post("/send", response_model=ChatResponse)
-def send_to_ai(payload: ChatSendPayload, username: str = Depends(get_current_username)):
+async def send_to_ai(payload: ChatSendPayload, username: str = Depends(get_current_username)):
     """
     Comandos:
       - /perfil ...               → atualiza perfil e retorna metas
@@ -371,187 +604,136 @@ def send_to_ai(payload: ChatSendPayload, username: str = Depends(get_current_use
     Caso contrário: conversa normal com a Lina (system prompt com profile+targets).
     """
     try:
-        if not api_key:
+        if not OPENAI_API_KEY:
             raise HTTPException(500, "OpenAI API key não configurada")
 
-        user_data = buscar_usuario(username)
-        nome = user_data.get("nome") if user_data else None
-        txt = payload.message.strip()
-        low_cmd = txt.lower()
-
-        # --- /perfil ---
-        if low_cmd.startswith("/perfil"):
-            patch = _parse_perfil_cmd(txt)
-            if not patch:
-                msg = ("Uso: /perfil sex=M age=30 height=180 weight=92 activity=1.55 "
-                       "goal=gain pace=0.5 restrictions=lactose,gluten confirm_low_calorie=true")
-                salvar_chat_message(username, "user", payload.message, "text")
-                salvar_chat_message(username, "bot", msg, "text")
-                return ChatResponse(response=msg)
-
-            _validate_profile_patch(patch)
-            _patch_profile(username, patch)
-
-            sys_prompt, ctx = build_lina_system_prompt(username)
-            t = ctx.get("targets") or {}
-            trg = t.get("targets") or {}
-            resumo = (
-                "Perfil atualizado com sucesso! ✅\n\n"
-                f"Metas do dia:\n"
-                f"- Calorias: {int(trg.get('kcal', 0))} kcal\n"
-                f"- Proteínas: {int(trg.get('protein_g', 0))} g\n"
-                f"- Gorduras: {int(trg.get('fat_g', 0))} g\n"
-                f"- Carboidratos: {int(trg.get('carbs_g', 0))} g"
+        reply = await _handle_command(username, payload.message)
+        if reply is not None:
+            await asyncio.to_thread(
+                salvar_chat_messages, username, [("user", payload.message, "text"), ("bot", reply, "text")]
             )
-            salvar_chat_message(username, "user", payload.message, "text")
-            salvar_chat_message(username, "bot", resumo, "text")
-            return ChatResponse(response=resumo)
-
-        # --- confirmar / revogar kcal baixa ---
-        if low_cmd.startswith("/confirmar_kcal_baixa") or low_cmd.startswith("/liberar_kcal_baixa") or low_cmd.startswith("/confirmar_deficit") or "liberar_deficit" in low_cmd:
-            _patch_profile(username, {"confirm_low_calorie": True})
-            msg = "Confirmação registrada ✅. Metas abaixo do mínimo podem ser usadas."
-            salvar_chat_message(username, "user", payload.message, "text")
-            salvar_chat_message(username, "bot", msg, "text")
-            return ChatResponse(response=msg)
-
-        if low_cmd.startswith("/revogar_kcal_baixa") or low_cmd.startswith("/revogar_deficit") or low_cmd.startswith("/bloquear_deficit"):
-            _patch_profile(username, {"confirm_low_calorie": False})
-            msg = "Confirmação revogada ✅. Vou respeitar os mínimos de segurança novamente."
-            salvar_chat_message(username, "user", payload.message, "text")
-            salvar_chat_message(username, "bot", msg, "text")
-            return ChatResponse(response=msg)
-
-        # --- /limpar_dia ---
-        if low_cmd.startswith("/limpar_dia"):
-            _reset_intake(username)
-            sys_prompt, ctx = build_lina_system_prompt(username)
-            status_txt = _format_status(_get_intake(username), ctx)
-            msg = "Dia zerado ✅\n\n" + status_txt
-            salvar_chat_message(username, "user", payload.message, "text")
-            salvar_chat_message(username, "bot", msg, "text")
-            return ChatResponse(response=msg)
-
-        # --- /status ---
-        if low_cmd.startswith("/status"):
-            sys_prompt, ctx = build_lina_system_prompt(username)
-            status_txt = _format_status(_get_intake(username), ctx)
-            salvar_chat_message(username, "user", payload.message, "text")
-            salvar_chat_message(username, "bot", status_txt, "text")
-            return ChatResponse(response=status_txt)
-
-        # --- /consumo ---
-        if low_cmd.startswith("/consumo"):
-            kcal, p, c, f = _parse_consumo(txt)
-            if (kcal + p + c + f) <= 0:
-                msg = "Uso: `/consumo 1300` ou `/consumo kcal=700 p=50 c=80 f=20`"
-                salvar_chat_message(username, "user", payload.message, "text")
-                salvar_chat_message(username, "bot", msg, "text")
-                return ChatResponse(response=msg)
-
-            _upsert_intake(username, kcal, p, c, f)
-            sys_prompt, ctx = build_lina_system_prompt(username)
-            status_txt = _format_status(_get_intake(username), ctx)
-            msg = f"Consumo registrado ✅ (+{int(kcal)} kcal, +{int(p)}g P, +{int(c)}g C, +{int(f)}g G)\n\n{status_txt}"
-            salvar_chat_message(username, "user", payload.message, "text")
-            salvar_chat_message(username, "bot", msg, "text")
-            return ChatResponse(response=msg)
-
-        # --- /refeicao ---
-        if low_cmd.startswith("/refeicao"):
-            parts = txt.split(None, 1)
-            if len(parts) < 2 or not parts[1].strip():
-                msg = "Uso: /refeicao <descrição da refeição> (ex: '/refeicao 150g frango grelhado, 1 xíc. arroz, salada')."
-                salvar_chat_message(username, "user", payload.message, "text")
-                salvar_chat_message(username, "bot", msg, "text")
-                return ChatResponse(response=msg)
-
-            description = parts[1].strip()
-            sys_prompt, ctx = build_lina_system_prompt(username)
-
-            meal = _analyze_meal_text(description)
-            t = meal.get("totais") or {}
-            _upsert_intake(
-                username,
-                float(t.get("kcal") or 0),
-                float(t.get("protein_g") or 0),
-                float(t.get("carbs_g") or 0),
-                float(t.get("fat_g") or 0),
-            )
-            status_txt = _format_status(_get_intake(username), ctx)
-            reply = _format_meal_reply(username, meal, ctx.get("targets"), status_txt)
-
-            salvar_chat_message(username, "user", payload.message, "text")
-            salvar_chat_message(username, "bot", reply, "text")
             return ChatResponse(response=reply)
 
         # --- Conversa normal com a Lina ---
-        try:
-            sys_prompt, ctx = build_lina_system_prompt(username)
-        except Exception:
-            sys_prompt = get_lina_chat_prompt(username, nome)
-            ctx = {"profile": None, "targets": None}
-
-        history = buscar_chat_history(username, limit=8) or []
-        messages: list[dict] = [{"role": "system", "content": sys_prompt}]
-        for msg in history:
-            if isinstance(msg, dict) and "role" in msg and "text" in msg:
-                role = msg.get("role", "user")
-                if role == "bot":
-                    role = "assistant"
-                content = msg.get("text", "")
-                if content:
-                    messages.append({"role": role, "content": content})
-        messages.append({"role": "user", "content": txt})
-
-        model = os.getenv("CHAT_MODEL", "gpt-4o-mini")
-        resp = client.chat.completions.create(
-            model=model,
+        txt = payload.message.strip()
+        messages = await _lina_messages(username, txt)
+        resp = await get_openai().chat.completions.create(
+            model=CHAT_MODEL,
             messages=messages,
             max_tokens=700,
             temperature=0.6,
         )
         content = (resp.choices[0].message.content or "").strip()
 
-        salvar_chat_message(username, "user", txt, "text")
-        salvar_chat_message(username, "bot", content, "text")
+        await asyncio.to_thread(salvar_chat_messages, username, [("user", txt, "text"), ("bot", content, "text")])
         return ChatResponse(response=content)
 
-    except openai.AuthenticationError as e:
-        raise HTTPException(502, "Erro de autenticação com OpenAI. Verifique a API key.") from e
-    except openai.APIError as e:
-        raise HTTPException(502, f"Erro da API OpenAI: {str(e)}") from e
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
-        print(f"❌ ERRO geral: {type(e).__name__}: {str(e)}")
-        print(traceback.format_exc())
-        raise HTTPException(502, f"Erro ao conectar com a IA: {str(e)}")
+        raise _erro_ia(e) from e
+
+@router.post("/send/stream")
+async def send_to_ai_stream(payload: ChatSendPayload, username: str = Depends(get_current_username)):
+    """
+    Igual ao /send, mas em server-sent events: `data: {"delta": "..."}` a cada trecho
+    gerado e `event: done` no fim. Comandos (/perfil, /status...) saem num único evento.
+    """
+    if not OPENAI_API_KEY:
+        raise HTTPException(500, "OpenAI API key não configurada")
+    try:
+        # comandos também falham antes do primeiro byte (OpenAI no /refeicao, DB no /status):
+        # mesmo mapeamento de erro do /send
+        reply = await _handle_command(username, payload.message)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _erro_ia(e) from e
+    if reply is not None:
+        try:
+            await asyncio.to_thread(
+                salvar_chat_messages, username, [("user", payload.message, "text"), ("bot", reply, "text")]
+            )
+        except Exception as e:
+            raise _erro_ia(e) from e
+
+        async def single():
+            yield _sse({"delta": reply})
+            yield _sse({}, event="done")
+        return StreamingResponse(single(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+    txt = payload.message.strip()
+    try:
+        messages = await _lina_messages(username, txt)
+        stream = await get_openai().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            max_tokens=700,
+            temperature=0.6,
+            stream=True,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        # antes do primeiro byte ainda dá para responder com status HTTP de erro
+        raise _erro_ia(e) from e
+
+    async def token_stream():
+        parts: list[str] = []
+        saved = False
+
+        async def save() -> None:
+            nonlocal saved
+            content = "".join(parts).strip()
+            if content and not saved:
+                saved = True
+                await asyncio.to_thread(
+                    salvar_chat_messages, username, [("user", txt, "text"), ("bot", content, "text")]
+                )
+
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield _sse({"delta": delta})
+            # antes do "done": o cliente pode pedir o histórico logo em seguida, e só
+            # recebe "done" se o turno foi gravado (falha do banco vira evento "error")
+            await save()
+            yield _sse({}, event="done")
+        except Exception as e:
+            logger.exception("Erro no streaming do chat")
+            yield _sse({"detail": f"Erro ao conectar com a IA: {e}"}, event="error")
+        finally:
+            # cliente desconectou ou a OpenAI caiu no meio: guarda o que já foi gerado.
+            # shield: no disconnect o gerador está sendo cancelado e o await seria interrompido
+            with anyio.CancelScope(shield=True):
+                # fecha a resposta HTTP da OpenAI: sem isso o modelo segue gerando (e cobrando)
+                # até max_tokens depois que o cliente já foi embora
+                await stream.close()
+                try:
+                    await save()
+                except Exception:
+                    logger.exception("Falha ao salvar resposta parcial do chat")
+
+    return StreamingResponse(token_stream(), media_type="text/event-stream", headers=_SSE_HEADERS)
 
 @router.get("/history", response_model=ChatHistoryResponse)
-def get_chat_history(username: str = Depends(get_current_username)):
+async def get_chat_history(username: str = Depends(get_current_username)):
     try:
-        history = buscar_chat_history(username, limit=50) or []
-        formatted_history = []
-        for msg in history:
-            if isinstance(msg, dict):
-                formatted_history.append({
-                    "role": msg.get("role", "user"),
-                    "text": msg.get("text", ""),
-                    "type": msg.get("type", "text"),
-                    "imageUrl": msg.get("imageUrl"),
-                    "created_at": msg.get("created_at", "")
-                })
-        return ChatHistoryResponse(history=formatted_history)
+        # dicts já no formato da resposta: o response_model serializa via pydantic-core
+        return {"history": await _recent_history(username, 50)}
     except Exception:
-        return ChatHistoryResponse(history=[])
+        logger.exception("Falha ao buscar histórico do chat")
+        return {"history": []}
 
 @router.post("/save")
-def save_chat_message_endpoint(message_data: dict, username: str = Depends(get_current_username)):
+async def save_chat_message_endpoint(message_data: dict, username: str = Depends(get_current_username)):
     try:
         role = message_data.get("role", "user")
         text = message_data.get("text", "")
         message_type = message_data.get("type", "text")
-        salvar_chat_message(username, role, text, message_type)
+        await asyncio.to_thread(salvar_chat_message, username, role, text, message_type)
         return {"status": "success", "message": "Mensagem salva"}
     except Exception as e:
         raise HTTPException(500, f"Erro ao salvar mensagem: {e}")
@@ -3,7 +3,6 @@ from pydantic import BaseModel
 from typing import List, Optional
 
 from app.auth import get_current_user
-from app.db import salvar_usuario
 
 # Prefix removido para evitar duplicação de /chat
 router = APIRouter(
@@ -18,6 +17,8 @@ class ChatMessage(BaseModel):
     imageUrl: Optional[str] = None
     created_at: str
 
+# Rotas legadas (antes do histórico ir para chat_messages): o histórico real fica em
+# /api/chat/history e /api/chat/save. Mantidas só por compatibilidade de URL.
 @router.get("/history", response_model=List[ChatMessage])
 def get_chat_history(current_user: dict = Depends(get_current_user)):
     """
@@ -31,10 +32,6 @@ def save_chat_message(
     current_user: dict = Depends(get_current_user),
 ):
     """
-    Persiste uma nova mensagem de chat no histórico do usuário.
+    Legado: não persiste nada (o dict do usuário não guarda mais o histórico).
     """
-    history = current_user.get("chat_history") or []
-    history.append(msg.dict())
-    current_user["chat_history"] = history
-    salvar_usuario(current_user)
     return msg
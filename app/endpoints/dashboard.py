@@ -5,10 +5,10 @@ from typing import List, Optional, Dict, Any
 
 from fastapi import APIRouter, Depends, Query, HTTPException
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import and_, bindparam, select
 
 from app.auth import get_current_user
-from app.db import session_scope, User, WeightLog
+from app.db import ENGINE, User, WeightLog
 
 router = APIRouter(tags=["dashboard"])
 
@@ -37,6 +37,23 @@ def _to_utc_iso(dt: datetime) -> str:
     return dt.isoformat()
 
 
+# Usuário + logs em uma query: users LEFT JOIN weight_logs (corte de período no ON, para um
+# usuário sem logs no período ainda devolver a linha dele). Não usa o usuário em cache do
+# get_current_user: altura/peso inicial/objetivo aparecem aqui logo após atualizar o perfil.
+def _sel_metrics(*cond):
+    return (
+        select(User.height_cm, User.initial_weight, User.objetivo, WeightLog.recorded_at, WeightLog.weight)
+        .select_from(User)
+        .outerjoin(WeightLog, and_(WeightLog.user_id == User.id, *cond))
+        .where(User.id == bindparam("uid"))
+        .order_by(WeightLog.recorded_at.asc())
+    )
+
+
+_SEL_METRICS = _sel_metrics()
+_SEL_METRICS_DESDE = _sel_metrics(WeightLog.recorded_at >= bindparam("cutoff"))
+
+
 @router.get("/metrics", response_model=DashboardMetricsOut)
 def get_dashboard_metrics(
     period: Optional[str] = Query(None, description="Período: '7d', '30d', '1y'"),
@@ -45,72 +62,69 @@ def get_dashboard_metrics(
     if not current_user:
         raise HTTPException(401, "Não autenticado")
 
-    username = current_user["username"]
+    stmt, params = _SEL_METRICS, {"uid": current_user["id"]}
+
+    # Filtro por período
+    if period:
+        try:
+            qty = int(period[:-1])
+            unit = period[-1].lower()
+            now = datetime.now(timezone.utc)
+            if unit == "d":
+                cutoff = now - timedelta(days=qty)
+            elif unit == "y":
+                cutoff = now - timedelta(days=qty * 365)
+            else:
+                cutoff = now - timedelta(days=qty)  # default para dias
+
+            stmt, params = _SEL_METRICS_DESDE, {**params, "cutoff": cutoff}
+        except Exception:
+            pass  # período inválido -> não filtra
+
+    # Usuário + logs ordenados por data
+    with ENGINE.connect() as conn:
+        rows = conn.execute(stmt, params).all()
+    if not rows:
+        raise HTTPException(401, "Não autenticado")
+    user = rows[0]
+    # sem logs o LEFT JOIN devolve uma linha só com as colunas do usuário
+    logs = [r for r in rows if r.recorded_at is not None]
+
+    # --- Métricas ---
+    height_cm = user.height_cm
+    initial_weight = user.initial_weight
+    current_weight = logs[-1].weight if logs else None
+
+    # Se não tem initial_weight definido, usa o primeiro log
+    if initial_weight is None and logs:
+        initial_weight = logs[0].weight
+
+    def _bmi(w: Optional[float], h_cm: Optional[float]) -> Optional[float]:
+        if not w or not h_cm or h_cm <= 0:
+            return None
+        h_m = h_cm / 100.0
+        return round(w / (h_m * h_m), 2) if h_m > 0 else None
+
+    bmi = _bmi(current_weight, height_cm)
+
+    weight_lost: Optional[float] = None
+    if initial_weight is not None and current_weight is not None:
+        weight_lost = round(initial_weight - current_weight, 2)
+
+    objective = user.objetivo  # campo objetivo na tabela User
+    
+    # Constrói histórico
+    history: List[LogItem] = [
+        LogItem(date=_to_utc_iso(log.recorded_at), weight=log.weight)
+        for log in logs
+    ]
     
-    with session_scope() as db:
-        # Busca o usuário
-        user = db.execute(select(User).where(User.username == username)).scalar_one_or_none()
-        if not user:
-            raise HTTPException(404, "Usuário não encontrado")
-        
-        # Query base para logs
-        query = select(WeightLog).where(WeightLog.user_id == user.id)
-        
-        # Filtro por período
-        if period:
-            try:
-                qty = int(period[:-1])
-                unit = period[-1].lower()
-                now = datetime.now(timezone.utc)
-                if unit == "d":
-                    cutoff = now - timedelta(days=qty)
-                elif unit == "y":
-                    cutoff = now - timedelta(days=qty * 365)
-                else:
-                    cutoff = now - timedelta(days=qty)  # default para dias
-                
-                query = query.where(WeightLog.recorded_at >= cutoff)
-            except Exception:
-                pass  # período inválido -> não filtra
-        
-        # Busca logs ordenados por data
-        logs = db.execute(query.order_by(WeightLog.recorded_at.asc())).scalars().all()
-        
-        # --- Métricas ---
-        height_cm = user.height_cm
-        initial_weight = user.initial_weight
-        current_weight = logs[-1].weight if logs else None
-        
-        # Se não tem initial_weight definido, usa o primeiro log
-        if initial_weight is None and logs:
-            initial_weight = logs[0].weight
-        
-        def _bmi(w: Optional[float], h_cm: Optional[float]) -> Optional[float]:
-            if not w or not h_cm or h_cm <= 0:
-                return None
-            h_m = h_cm / 100.0
-            return round(w / (h_m * h_m), 2) if h_m > 0 else None
-        
-        bmi = _bmi(current_weight, height_cm)
-        
-        weight_lost: Optional[float] = None
-        if initial_weight is not None and current_weight is not None:
-            weight_lost = round(initial_weight - current_weight, 2)
-        
-        objective = user.objetivo  # campo objetivo na tabela User
-        
-        # Constrói histórico
-        history: List[LogItem] = [
-            LogItem(date=_to_utc_iso(log.recorded_at), weight=log.weight)
-            for log in logs
-        ]
-        
-        return DashboardMetricsOut(
-            objective=objective,
-            height_cm=height_cm,
-            initial_weight=initial_weight,
-            current_weight=current_weight,
-            weight_lost=weight_lost,
-            bmi=bmi,
-            history=history,
-        )
\ No newline at end of file
+    return DashboardMetricsOut(
+        objective=objective,
+        height_cm=height_cm,
+        initial_weight=initial_weight,
+        current_weight=current_weight,
+        weight_lost=weight_lost,
+        bmi=bmi,
+        history=history,
+    )
\ No newline at end of file
@@ -1,25 +1,79 @@
 # app/endpoints/image.py
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from app.auth import get_current_username
-from openai import OpenAI
 from dotenv import load_dotenv
 from app.db import salvar_meal_analysis
+from app.services.openai_client import OPENAI_API_KEY, get_openai
 
-import os
+import io
+import asyncio
 import base64
-import imghdr
+import logging
+
+from PIL import Image, ImageOps
 
 load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-ALLOWED_IMG_TYPES = {"jpeg", "png", "webp", "gif"}
+# assinaturas (magic numbers) dos formatos aceitos; imghdr saiu no Python 3.13
+_IMG_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF8", "gif"),
+)
 
 
 def _sniff_image_type(data: bytes, fallback: str = "jpeg") -> str:
-    kind = imghdr.what(None, h=data)
-    return kind if kind in ALLOWED_IMG_TYPES else fallback
+    for sig, kind in _IMG_SIGNATURES:
+        if data.startswith(sig):
+            return kind
+    # WebP = contêiner RIFF com "WEBP" nos bytes 8-12 (RIFF sozinho também é WAV/AVI)
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return fallback
+
+
+MAX_IMAGE_BYTES = 8 * 1024 * 1024
+_READ_CHUNK = 64 * 1024
+
+
+async def _read_upload(file: UploadFile) -> bytearray:
+    """Lê o upload em blocos; 413 assim que passar de MAX_IMAGE_BYTES, sem carregar o resto."""
+    too_big = HTTPException(status_code=413, detail="Imagem muito grande (máx. 8MB).")
+    # tamanho declarado no multipart: rejeita antes de ler qualquer byte
+    if file.size is not None and file.size > MAX_IMAGE_BYTES:
+        raise too_big
+    buf = bytearray()
+    while chunk := await file.read(_READ_CHUNK):
+        buf += chunk
+        if len(buf) > MAX_IMAGE_BYTES:
+            raise too_big
+    return buf
+
+
+# Vision não precisa de mais que isso; foto de celular (4000x3000, ~6MB) vira ~150kB
+IMG_MAX_SIDE = 1024
+_JPEG_QUALITY = 85
+_FORMATOS_OPENAI = {"JPEG", "PNG", "WEBP", "GIF"}
+
+
+def _preparar_data_url(data: bytearray) -> str:
+    """Data URL da imagem reduzida a IMG_MAX_SIDE e recomprimida em JPEG (CPU: rodar em thread)."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            fmt = img.format
+            if max(img.size) > IMG_MAX_SIDE or fmt not in _FORMATOS_OPENAI:
+                img.draft("RGB", (IMG_MAX_SIDE, IMG_MAX_SIDE))  # JPEG decodifica já reduzido
+                img = ImageOps.exif_transpose(img)  # foto de celular vem "deitada" no EXIF
+                img.thumbnail((IMG_MAX_SIDE, IMG_MAX_SIDE), Image.Resampling.LANCZOS)
+                out = io.BytesIO()
+                img.convert("RGB").save(out, "JPEG", quality=_JPEG_QUALITY, optimize=True)
+                data, fmt = out.getvalue(), "JPEG"
+    except (OSError, Image.DecompressionBombError):  # UnidentifiedImageError é OSError
+        raise HTTPException(status_code=400, detail="Envie um arquivo de imagem válido.")
+    return f"data:image/{fmt.lower()};base64,{base64.b64encode(data).decode('ascii')}"
 
 
 def get_lina_prompt(username: str) -> str:
@@ -66,30 +120,26 @@ async def analyze_image(
     if not OPENAI_API_KEY:
         raise HTTPException(status_code=500, detail="OPENAI_API_KEY não configurada.")
 
-    # Lê arquivo
-    image_bytes = await file.read()
+    # Lê arquivo (em blocos, cortando no limite de tamanho)
+    image_bytes = await _read_upload(file)
     if not image_bytes:
         raise HTTPException(status_code=400, detail="Arquivo de imagem vazio.")
 
-    # Tamanho (8MB)
-    if len(image_bytes) > 8 * 1024 * 1024:
-        raise HTTPException(status_code=413, detail="Imagem muito grande (máx. 8MB).")
-
     # Content-Type seguro
     content_type = file.content_type or f"image/{_sniff_image_type(image_bytes)}"
     if not content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Envie um arquivo de imagem válido.")
 
-    # Data URL
-    data_url = f"data:{content_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+    # Data URL (decode/resize fora do event loop; o buffer bruto é liberado antes da chamada à OpenAI)
+    data_url = await asyncio.to_thread(_preparar_data_url, image_bytes)
+    del image_bytes
 
     # Prompts
     system_prompt = get_lina_prompt(username)
 
     # OpenAI
-    client = OpenAI(api_key=OPENAI_API_KEY)
     try:
-        response = client.chat.completions.create(
+        response = await get_openai().chat.completions.create(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -111,10 +161,11 @@ async def analyze_image(
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"Falha na análise: {e}")
 
-    # Persistência (não quebra a resposta se falhar)
+    # Persistência síncrona (fora do event loop): só responde sucesso com a análise gravada
     try:
-        salvar_meal_analysis(username, resultado, getattr(file, "filename", "upload"))
-    except Exception as e:
-        print(f"[WARN] Falha ao salvar análise: {e}")
+        await asyncio.to_thread(salvar_meal_analysis, username, resultado, getattr(file, "filename", "upload"))
+    except Exception:
+        logger.exception("Falha ao salvar análise")
+        raise HTTPException(status_code=503, detail="Não foi possível salvar a análise. Tente novamente.")
 
     return {"usuario": username, "analise": resultado}
@@ -1,13 +1,13 @@
 # app/endpoints/meal.py
-from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
+from uuid import UUID
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel, Field
 from sqlalchemy import select, delete
 
 from app.auth import get_current_user  # retorna dict com dados do usuário
-from app.db import session_scope, User, MealAnalysis
+from app.db import session_scope, User, MealAnalysis, buscar_meal_history, buscar_meal_detail
 
 router = APIRouter(tags=["meal"])
 
@@ -19,6 +19,8 @@ class MealIn(BaseModel):
 
 
 class MealOut(MealIn):
+    # análises de imagem são gravadas como texto livre (JSONB string), não objeto
+    analise: Union[Dict[str, Any], str]
     id: str
     usuario: str
     data: str
@@ -32,39 +34,35 @@ def _require_username(current_user: dict) -> str:
     return username
 
 
+def _meal_to_dict(username: str, m: MealAnalysis) -> Dict[str, Any]:
+    return {
+        "id": str(m.id),
+        "usuario": username,
+        "analise": m.analysis or {},
+        "imagem_nome": m.image_name,
+        "data": m.created_at.isoformat(),
+    }
+
+
 def _meal_to_out(username: str, m: MealAnalysis) -> MealOut:
-    return MealOut(
-        id=str(m.id),
-        usuario=username,
-        analise=m.analysis or {},
-        imagem_nome=m.image_name,
-        data=m.created_at.isoformat(),
-    )
+    return MealOut(**_meal_to_dict(username, m))
 
 
 # ===== Rotas =====
 @router.get("", response_model=List[MealOut])
 def list_meals(
     limit: int = 10,
+    resumo: bool = False,
     current_user: dict = Depends(get_current_user),
 ):
-    """Lista refeições do usuário (mais recentes primeiro)."""
+    """Lista refeições do usuário (mais recentes primeiro).
+
+    Com `resumo=true`, `analise` traz só `totais` e `items`; a análise completa
+    fica em GET /{meal_id}.
+    """
     username = _require_username(current_user)
-    with session_scope() as db:
-        u = db.execute(select(User).where(User.username == username)).scalar_one_or_none()
-        if not u:
-            return []
-        rows = (
-            db.execute(
-                select(MealAnalysis)
-                .where(MealAnalysis.user_id == u.id)
-                .order_by(MealAnalysis.created_at.desc())
-                .limit(limit)
-            )
-            .scalars()
-            .all()
-        )
-        return [_meal_to_out(username, r) for r in rows]
+    # tuplas Core (sem hidratar MealAnalysis), já no formato de MealOut
+    return buscar_meal_history(username, limit, completo=not resumo)
 
 
 @router.post("", response_model=MealOut, status_code=status.HTTP_201_CREATED)
@@ -74,7 +72,6 @@ def create_meal(
 ):
     """Cria uma refeição."""
     username = _require_username(current_user)
-    now = datetime.utcnow()
     with session_scope() as db:
         u = db.execute(select(User).where(User.username == username)).scalar_one_or_none()
         if not u:
@@ -84,7 +81,6 @@ def create_meal(
             user_id=u.id,
             analysis=body.analise,
             image_name=body.imagem_nome,
-            created_at=now,
         )
         db.add(meal)
         db.flush()  # garante ID
@@ -123,6 +119,20 @@ def save_meal(meal: MealIn, current_user: dict = Depends(get_current_user)):
 
 
 @router.get("/history", response_model=List[MealOut])
-def get_meal_history(limit: int = 10, current_user: dict = Depends(get_current_user)):
+def get_meal_history(limit: int = 10, resumo: bool = False, current_user: dict = Depends(get_current_user)):
     """Compat: histórico (equivale ao GET base)."""
-    return list_meals(limit, current_user)
+    return list_meals(limit, resumo, current_user)
+
+
+# registrada por último para não capturar /history
+@router.get("/{meal_id}", response_model=MealOut)
+def get_meal(
+    meal_id: UUID,
+    current_user: dict = Depends(get_current_user),
+):
+    """Retorna uma refeição do usuário com a análise completa."""
+    username = _require_username(current_user)
+    meal = buscar_meal_detail(username, str(meal_id))
+    if not meal:
+        raise HTTPException(status_code=404, detail="Refeição não encontrada")
+    return meal
@@ -3,13 +3,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field
 from typing import Optional, List, Literal, Dict, Any, Tuple
 from app.auth import get_current_username
-import os
-
-try:
-    import psycopg2
-    import psycopg2.extras
-except ImportError as e:
-    raise RuntimeError("psycopg2 não encontrado. Adicione 'psycopg2-binary' ao requirements.txt") from e
+from app.db import atualizar_perfil, buscar_perfil
 
 router = APIRouter()
 
@@ -17,7 +11,8 @@ router = APIRouter()
 GoalType = Literal["lose", "maintain", "gain"]
 SexType = Literal["M", "F"]
 
-ALLOWED_ACTIVITY = {1.2, 1.375, 1.55, 1.725, 1.9}
+ALLOWED_ACTIVITY = frozenset({1.2, 1.375, 1.55, 1.725, 1.9})
+ALLOWED_ACTIVITY_SORTED = tuple(sorted(ALLOWED_ACTIVITY))
 
 class NutritionProfileOut(BaseModel):
     # 🔧 Agora opcional para não quebrar GET /profile quando vazio no banco
@@ -50,24 +45,6 @@ class TargetsOut(BaseModel):
     blocked: bool
 
 # --------- DB HELPERS ---------
-def _dsn_from_env() -> dict:
-    url = os.getenv("DATABASE_URL")
-    if url:
-        return {"dsn": url}
-    return {
-        "host": os.getenv("PGHOST") or os.getenv("DB_HOST") or "127.0.0.1",
-        "port": int(os.getenv("PGPORT") or 5432),
-        "dbname": os.getenv("PGDATABASE") or os.getenv("DB_NAME") or "nutriflow",
-        "user": os.getenv("PGUSER") or os.getenv("DB_USER") or "nutriflow_user",
-        "password": os.getenv("PGPASSWORD") or os.getenv("DB_PASSWORD") or None,
-    }
-
-def _get_conn():
-    cfg = _dsn_from_env()
-    if "dsn" in cfg:
-        return psycopg2.connect(cfg["dsn"], sslmode=os.getenv("PGSSLMODE","prefer"))
-    return psycopg2.connect(**cfg)
-
 def _map_objetivo_to_goal_type(obj: Optional[str]) -> GoalType:
     s = (obj or "").strip().lower()
     if any(k in s for k in ["perder", "emagrec", "déficit", "deficit", "cut"]):
@@ -77,49 +54,39 @@ def _map_objetivo_to_goal_type(obj: Optional[str]) -> GoalType:
     return "maintain"
 
 def _fetch_profile(username: str) -> NutritionProfileOut:
-    with _get_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-        cur.execute(
-            """
-            SELECT sex, age, height_cm, current_weight, activity_level, goal_type,
-                   pace_kg_per_week, restrictions, confirm_low_calorie, objetivo
-            FROM public.users
-            WHERE username = %s
-            """,
-            (username,),
-        )
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Usuário não encontrado.")
-
-        # Normalizações e defaults seguros
-        sex_raw = row["sex"]
-        sex_norm: Optional[SexType] = None
-        if isinstance(sex_raw, str) and sex_raw.strip():
-            up = sex_raw.strip().upper()
-            if up in ("M", "F"):
-                sex_norm = up  # type: ignore[assignment]
-
-        restrictions_db = row.get("restrictions")
-        if isinstance(restrictions_db, list):
-            restrictions = [str(x) for x in restrictions_db]
-        else:
-            restrictions = []
-
-        # Se goal_type estiver vazio, inferimos a partir de 'objetivo' legível
-        goal_type = row.get("goal_type") or _map_objetivo_to_goal_type(row.get("objetivo"))
-
-        profile = NutritionProfileOut(
-            sex=sex_norm,  # pode ser None aqui
-            age=int(row["age"]) if row["age"] is not None else 0,
-            height_cm=float(row["height_cm"]) if row["height_cm"] is not None else 0.0,
-            current_weight=float(row["current_weight"]) if row["current_weight"] is not None else 0.0,
-            activity_level=float(row["activity_level"]) if row["activity_level"] is not None else 1.2,
-            goal_type=goal_type,  # garantido por _map_objetivo_to_goal_type
-            pace_kg_per_week=float(row["pace_kg_per_week"]) if row["pace_kg_per_week"] is not None else None,
-            restrictions=restrictions,
-            confirm_low_calorie=bool(row["confirm_low_calorie"]),
-        )
-        return profile
+    row = buscar_perfil(username)
+    if not row:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado.")
+
+    # Normalizações e defaults seguros
+    sex_raw = row["sex"]
+    sex_norm: Optional[SexType] = None
+    if isinstance(sex_raw, str) and sex_raw.strip():
+        up = sex_raw.strip().upper()
+        if up in ("M", "F"):
+            sex_norm = up  # type: ignore[assignment]
+
+    restrictions_db = row.get("restrictions")
+    if isinstance(restrictions_db, list):
+        restrictions = [str(x) for x in restrictions_db]
+    else:
+        restrictions = []
+
+    # Se goal_type estiver vazio, inferimos a partir de 'objetivo' legível
+    goal_type = row.get("goal_type") or _map_objetivo_to_goal_type(row.get("objetivo"))
+
+    profile = NutritionProfileOut(
+        sex=sex_norm,  # pode ser None aqui
+        age=int(row["age"]) if row["age"] is not None else 0,
+        height_cm=float(row["height_cm"]) if row["height_cm"] is not None else 0.0,
+        current_weight=float(row["current_weight"]) if row["current_weight"] is not None else 0.0,
+        activity_level=float(row["activity_level"]) if row["activity_level"] is not None else 1.2,
+        goal_type=goal_type,  # garantido por _map_objetivo_to_goal_type
+        pace_kg_per_week=float(row["pace_kg_per_week"]) if row["pace_kg_per_week"] is not None else None,
+        restrictions=restrictions,
+        confirm_low_calorie=bool(row["confirm_low_calorie"]),
+    )
+    return profile
 
 def _validate_update(data: NutritionProfileUpdate) -> None:
     if data.age is not None and not (14 <= data.age <= 100):
@@ -134,7 +101,7 @@ def _validate_update(data: NutritionProfileUpdate) -> None:
         except:
             raise HTTPException(422, detail="activity_level inválido.")
         if lvl not in ALLOWED_ACTIVITY:
-            raise HTTPException(422, detail=f"activity_level deve ser um de {sorted(ALLOWED_ACTIVITY)}.")
+            raise HTTPException(422, detail=f"activity_level deve ser um de {list(ALLOWED_ACTIVITY_SORTED)}.")
     if data.pace_kg_per_week is not None:
         if not (0.10 <= float(data.pace_kg_per_week) <= 1.50):
             raise HTTPException(422, detail="pace_kg_per_week deve estar entre 0.10 e 1.50.")
@@ -143,46 +110,11 @@ def _validate_update(data: NutritionProfileUpdate) -> None:
             raise HTTPException(422, detail="restrictions deve ser lista de strings.")
 
 def _do_update(username: str, data: NutritionProfileUpdate) -> None:
-    fields = []
-    values = []
+    campos = data.model_dump()
     if data.sex is not None:
-        fields.append("sex = %s")
-        values.append(data.sex.upper())
-    if data.age is not None:
-        fields.append("age = %s")
-        values.append(int(data.age))
-    if data.height_cm is not None:
-        fields.append("height_cm = %s")
-        values.append(float(data.height_cm))
-    if data.current_weight is not None:
-        fields.append("current_weight = %s")
-        values.append(float(data.current_weight))
-    if data.activity_level is not None:
-        fields.append("activity_level = %s")
-        values.append(float(data.activity_level))
-    if data.goal_type is not None:
-        fields.append("goal_type = %s")
-        values.append(data.goal_type)
-    if data.pace_kg_per_week is not None:
-        fields.append("pace_kg_per_week = %s")
-        values.append(float(data.pace_kg_per_week))
-    if data.restrictions is not None:
-        fields.append("restrictions = %s")
-        values.append(psycopg2.extras.Json(data.restrictions))
-    if data.confirm_low_calorie is not None:
-        fields.append("confirm_low_calorie = %s")
-        values.append(bool(data.confirm_low_calorie))
-
-    if not fields:
-        return
-
-    values.append(username)
-    sql = f"UPDATE public.users SET {', '.join(fields)} WHERE username = %s"
-
-    with _get_conn() as conn, conn.cursor() as cur:
-        cur.execute(sql, values)
-        if cur.rowcount == 0:
-            raise HTTPException(404, detail="Usuário não encontrado.")
+        campos["sex"] = data.sex.upper()
+    if not atualizar_perfil(username, campos):
+        raise HTTPException(404, detail="Usuário não encontrado.")
 
 # --------- CÁLCULOS ---------
 def _round5(x: float) -> float:
@@ -281,7 +213,7 @@ def get_targets(username: str = Depends(get_current_username)):
     if profile.age <= 0 or profile.height_cm <= 0 or profile.current_weight <= 0:
         raise HTTPException(400, detail="Perfil incompleto: informe age, height_cm e current_weight.")
     if float(profile.activity_level) not in ALLOWED_ACTIVITY:
-        raise HTTPException(400, detail=f"activity_level deve ser um de {sorted(ALLOWED_ACTIVITY)}.")
+        raise HTTPException(400, detail=f"activity_level deve ser um de {list(ALLOWED_ACTIVITY_SORTED)}.")
     if profile.goal_type not in ("lose","maintain","gain"):
         raise HTTPException(400, detail="goal_type deve ser 'lose', 'maintain' ou 'gain'.")
 
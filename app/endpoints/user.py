@@ -13,7 +13,7 @@ from app.auth import (
     verify_password,
     hash_password
 )
-from app.db import session_scope, User
+from app.db import session_scope, User, invalidar_cache_usuario
 
 router = APIRouter(tags=["user"])
 
@@ -197,6 +197,7 @@ def update_profile(
         for field, value in updates.items():
             if hasattr(u, field):
                 setattr(u, field, value)
+    invalidar_cache_usuario(current_user["username"])
 
     # pós-commit, responde com dados frescos (evita DetachedInstanceError)
     return get_profile(request, current_user)
@@ -211,6 +212,7 @@ def update_password(
         if not u:
             raise HTTPException(404, "Usuário não encontrado")
         u.password_hash = hash_password(data.password)
+    invalidar_cache_usuario(current_user["username"])
 
 @router.post("/avatar")
 def upload_avatar(
@@ -245,4 +247,5 @@ def upload_avatar(
         public_url = str(request.url_for("static", path=f"avatars/{fname}"))
         u.avatar_url = public_url
 
-        return {"ok": True, "avatar_url": public_url}
+    invalidar_cache_usuario(current_user["username"])
+    return {"ok": True, "avatar_url": public_url}
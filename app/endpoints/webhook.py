@@ -2,13 +2,17 @@
 
 import os
 import hmac
+import logging
 import hashlib
+from uuid import uuid4
 from fastapi import APIRouter, Request, HTTPException, Header, BackgroundTasks
 import resend
 
+from app.auth import hash_password
 from app.db import grant_user_access, buscar_usuario, salvar_usuario
 
 router = APIRouter(tags=["webhook"])
+logger = logging.getLogger(__name__)
 
 # Carrega segredos do .env
 DISRUPTY_WEBHOOK_SECRET = os.getenv("DISRUPTY_WEBHOOK_SECRET")
@@ -47,10 +51,10 @@ async def send_welcome_email(to_email: str, customer_name: str):
         }
         
         email = resend.Emails.send(params)
-        print(f"[Resend] Email de boas-vindas enviado: {email}", flush=True)
+        logger.info("[Resend] Email de boas-vindas enviado: %s", email)
         
     except Exception as e:
-        print(f"[Resend] Erro ao enviar email de boas-vindas: {e}", flush=True)
+        logger.error("[Resend] Erro ao enviar email de boas-vindas: %s", e)
 
 @router.post("/payment")
 async def disrupty_payment_webhook(
@@ -78,17 +82,15 @@ async def disrupty_payment_webhook(
         customer_name = customer_data.get("name")
         
         if not customer_email:
-            print("❌ Email do cliente não encontrado no webhook")
+            logger.warning("Email do cliente não encontrado no webhook")
             return {"status": "email_not_found"}
 
         # 3) Busca ou cria usuário
-        user = buscar_usuario(customer_email)
+        user = buscar_usuario(customer_email, load_logs=False)
         
         if not user:
             # Cria novo usuário
-            print(f"🆕 Criando novo usuário: {customer_email}")
-            from app.auth import hash_password
-            from uuid import uuid4
+            logger.info("Criando novo usuário: %s", customer_email)
             
             new_user = {
                 "id": str(uuid4()),
@@ -107,11 +109,11 @@ async def disrupty_payment_webhook(
             user = new_user
         else:
             # Usuário já existe, só libera acesso
-            print(f"👤 Usuário existente: {customer_email}")
+            logger.info("Usuário existente: %s", customer_email)
             try:
                 await grant_user_access(user.get("id"))
             except Exception as e:
-                print(f"❌ Erro ao conceder acesso: {e}")
+                logger.error("Erro ao conceder acesso: %s", e)
                 return {"status": "error", "message": str(e)}
 
         # 4) Envia email com credenciais
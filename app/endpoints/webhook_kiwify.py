@@ -1,20 +1,20 @@
 from fastapi import APIRouter, Request
-import os
+import logging
 from typing import Optional, Tuple
-from datetime import datetime
 import uuid
 import secrets
 import string
 
 from app.services.email import send_access_email
-from sqlalchemy import create_engine, MetaData, Table, update, select, insert
+from app.auth import hash_password
+from app.db import ENGINE, User, invalidar_cache_usuario
+from sqlalchemy import update, select, insert
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, future=True)
-metadata = MetaData()
-users = Table("users", metadata, autoload_with=engine)
+# tabela do modelo (sem reflection no import: o schema só é criado no startup)
+users = User.__table__
 
 router = APIRouter(tags=["webhook"])
+logger = logging.getLogger(__name__)
 
 def _is_approved(payload: dict) -> bool:
     txt = " ".join([
@@ -38,12 +38,6 @@ def _generate_temp_password(length: int = 8) -> str:
     chars = string.ascii_letters + string.digits
     return ''.join(secrets.choice(chars) for _ in range(length))
 
-def _hash_password(password: str) -> str:
-    """Hash da senha usando bcrypt"""
-    from passlib.context import CryptContext
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    return pwd_context.hash(password)
-
 def _find_user(conn, email: str):
     """Procura usuário por username=email"""
     row = conn.execute(select(users).where(users.c.username == email)).fetchone()
@@ -55,7 +49,7 @@ def _ensure_access_with_password(email: str, name: Optional[str]) -> Tuple[int,
     Se usuário não existe, cria com senha temporária
     Se existe mas não tem acesso, libera acesso mas não altera senha
     """
-    with engine.begin() as conn:
+    with ENGINE.begin() as conn:
         row = _find_user(conn, email)
         
         if row:
@@ -72,7 +66,7 @@ def _ensure_access_with_password(email: str, name: Optional[str]) -> Tuple[int,
         
         # Usuário não existe -> criar com senha temporária
         temp_password = _generate_temp_password()
-        hashed_password = _hash_password(temp_password)
+        hashed_password = hash_password(temp_password)
         
         values = {
             "id": uuid.uuid4(),
@@ -80,7 +74,6 @@ def _ensure_access_with_password(email: str, name: Optional[str]) -> Tuple[int,
             "password_hash": hashed_password,
             "has_access": True,
             "is_admin": False,
-            "created_at": datetime.utcnow(),
         }
         if name and "nome" in users.c:
             values["nome"] = name
@@ -136,7 +129,7 @@ Equipe NutriFlow
         send_access_email(to=email, name=name, subject=subject, body=body)
         
     except Exception as e:
-        print(f"Erro ao enviar email: {e}")
+        logger.error("Erro ao enviar email: %s", e)
 
 @router.post("/kiwify")
 async def kiwify_webhook(request: Request):
@@ -150,6 +143,7 @@ async def kiwify_webhook(request: Request):
         return {"ok": True, "skipped": "not_approved"}
 
     updated, temp_password = _ensure_access_with_password(email, name)
+    invalidar_cache_usuario(email)
     
     # Envia email personalizado baseado se é novo usuário ou não
     send_welcome_email(email, name, temp_password)
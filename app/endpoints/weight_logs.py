@@ -9,7 +9,7 @@ from pydantic import BaseModel, confloat
 from sqlalchemy import select, update, delete
 
 from app.auth import get_current_user
-from app.db import session_scope, User, WeightLog
+from app.db import session_scope, User, WeightLog, invalidar_cache_usuario
 
 router = APIRouter(tags=["weight-logs"])
 
@@ -36,7 +36,10 @@ def _to_utc_iso(dt: datetime) -> str:
     return dt.isoformat()
 
 def _update_user_weights(db, user_id: str) -> None:
-    """Atualiza initial_weight e current_weight do usuário baseado nos logs"""
+    """
+    Atualiza initial_weight e current_weight do usuário baseado nos logs.
+    Quem chama invalida o cache do usuário depois do commit (fora do session_scope).
+    """
     logs = db.execute(
         select(WeightLog)
         .where(WeightLog.user_id == user_id)
@@ -95,11 +98,14 @@ def create_weight_log(payload: WeightLogIn, current_user: dict = Depends(get_cur
         # Atualiza pesos do usuário
         _update_user_weights(db, user.id)
         
-        return WeightLogOut(
+        out = WeightLogOut(
             id=str(log.id),
             weight=log.weight,
             recorded_at=_to_utc_iso(log.recorded_at)
         )
+    # após o commit: invalidar antes deixaria um get_current_user concorrente recachear os pesos antigos
+    invalidar_cache_usuario(username)
+    return out
 
 @router.get("", response_model=List[WeightLogOut])
 def list_weight_logs(
@@ -182,11 +188,14 @@ def update_weight_log(
         # Atualiza pesos do usuário
         _update_user_weights(db, user.id)
         
-        return WeightLogOut(
+        out = WeightLogOut(
             id=str(log.id),
             weight=log.weight,
             recorded_at=_to_utc_iso(log.recorded_at)
         )
+    # após o commit: invalidar antes deixaria um get_current_user concorrente recachear os pesos antigos
+    invalidar_cache_usuario(username)
+    return out
 
 @router.delete("/{log_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_weight_log(
@@ -215,5 +224,4 @@ def delete_weight_log(
         
         # Atualiza pesos do usuário
         _update_user_weights(db, user.id)
-        
-        return
\ No newline at end of file
+    invalidar_cache_usuario(username)  # após o commit
@@ -1,5 +1,10 @@
 # app/main.py
 import os
+import sys
+import queue
+import logging
+import logging.handlers
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -8,6 +13,20 @@ from dotenv import load_dotenv
 # Carrega variáveis de ambiente
 load_dotenv()
 
+# Logging: handlers do request só enfileiram; a escrita no stdout roda numa thread à parte
+def _setup_logging() -> logging.handlers.QueueListener:
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    return listener
+
+_log_listener = _setup_logging()
+
 # === Pastas para arquivos estáticos (avatars, etc.) ===
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 UPLOADS_ROOT = os.path.join(BASE_DIR, "uploads")
@@ -26,8 +45,23 @@ from app.endpoints.webhook import router as webhook_router  # webhook Disrupty
 from app.endpoints.webhook_kiwify import router as webhook_kiwify_router  # webhook Kiwify
 from app.endpoints.nutrition import router as nutrition_router  # NOVO: perfil e metas nutricionais
 
+from app.db import ENGINE, init_schema
+from app.services.openai_client import fechar_openai
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_schema()
+    yield
+    # Ordem de desligamento: banco → OpenAI → logging (último, para registrar falhas dos anteriores).
+    # Não há buffer para esvaziar: escritas de chat/refeição são commitadas antes da resposta.
+    try:
+        ENGINE.dispose()  # fecha as conexões do pool em vez de deixá-las cair no exit
+        await fechar_openai()  # fecha o pool HTTP compartilhado da OpenAI
+    finally:
+        _log_listener.stop()
+
 # Inicializa app
-app = FastAPI(title="IA Nutricionista SaaS", version="0.1.0")
+app = FastAPI(title="IA Nutricionista SaaS", version="0.1.0", lifespan=lifespan)
 
 # -------- CORS --------
 ALLOWED_ORIGINS = [
@@ -1,10 +1,13 @@
 # app/scripts/etl_tinydb_to_pg.py
-import os, json
-from datetime import datetime
+import os
+from functools import lru_cache
+
+import orjson
+from datetime import datetime, timezone
 from uuid import UUID
 
-from sqlalchemy import select
-from app.db import session_scope, User, WeightLog, ChatMessage, MealAnalysis
+from sqlalchemy import select, insert
+from app.db import init_schema, session_scope, User, WeightLog, ChatMessage, MealAnalysis
 
 # ===== Locais candidatos (raiz do repo e pasta app/) =====
 HERE = os.path.abspath(os.path.dirname(__file__))              # app/scripts
@@ -21,15 +24,17 @@ def find_path(filename: str) -> str | None:
             return p
     return None
 
+# db.json é lido por import_users e import_chat_from_embedded: parse uma vez só
+@lru_cache(maxsize=None)
 def load_json_any(*filenames):
     for name in filenames:
         p = find_path(name)
         if not p:
             continue
         try:
-            with open(p, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
+            with open(p, "rb") as f:
+                return orjson.loads(f.read())
+        except orjson.JSONDecodeError:
             print(f"⚠️  JSON inválido: {p}")
     # log amistoso se nenhum foi encontrado
     if filenames:
@@ -78,16 +83,18 @@ def upsert_user_from_dict(d: dict) -> str | None:
         if "is_admin"  in d: u.is_admin  = bool(d["is_admin"])
         if username in ADMIN_USERNAMES: u.is_admin = True
 
+        rows = []
         for item in (d.get("weight_logs") or []):
             try:
-                wl = WeightLog(
-                    user_id=u.id,
-                    weight=float(item["weight"]),
-                    recorded_at=parse_dt(item.get("recorded_at")),
-                )
-                db.add(wl)
+                rows.append({
+                    "user_id": u.id,
+                    "weight": float(item["weight"]),
+                    "recorded_at": parse_dt(item.get("recorded_at")),
+                })
             except Exception:
                 continue
+        if rows:
+            db.execute(insert(WeightLog), rows)  # executemany (insertmanyvalues)
     return username
 
 def import_users():
@@ -114,43 +121,63 @@ def import_users():
 
     print(f"✅ Usuários importados: {len(seen)}")
 
+def _user_ids() -> dict:
+    """username -> id de todos os usuários, carregado uma vez por etapa."""
+    with session_scope() as db:
+        return {name: uid for name, uid in db.execute(select(User.username, User.id))}
+
+def _utc(dt: datetime) -> datetime:
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+def _chat_row(username: str, m: dict, with_image: bool = True) -> dict:
+    return {
+        "username": username,
+        "role": m.get("role") or "user",
+        "text": m.get("text") or "",
+        "type": m.get("type") or "text",
+        "image_url": m.get("imageUrl") if with_image else None,
+        "created_at": _utc(parse_dt(m.get("created_at"))),
+    }
+
+def insert_chat_rows(rows: list) -> int:
+    """Insere mensagens em um único INSERT em lote, pulando as que já existem."""
+    ids = _user_ids()
+    with session_scope() as db:
+        existing = set(db.execute(select(ChatMessage.user_id, ChatMessage.text, ChatMessage.created_at)).tuples())
+        payload = []
+        for r in rows:
+            uid = ids.get(r.pop("username"))
+            if not uid:
+                continue
+            key = (uid, r["text"], r["created_at"])
+            if key in existing:
+                continue
+            existing.add(key)
+            payload.append({"user_id": uid, **r})
+        if payload:
+            db.execute(insert(ChatMessage), payload)
+    return len(payload)
+
 def import_chat_from_embedded():
     data = load_json_any("db.json") or {}
     default = data.get("_default") or {}
+    rows = []
     for _, v in default.items():
         username = (v or {}).get("username")
         if not username:
             continue
         for m in (v.get("chat_history") or []):
-            with session_scope() as db:
-                u = db.execute(select(User).where(User.username == username)).scalar_one_or_none()
-                if not u: continue
-                db.add(ChatMessage(
-                    user_id=u.id,
-                    role=m.get("role") or "user",
-                    text=m.get("text") or "",
-                    type=m.get("type") or "text",
-                    image_url=m.get("imageUrl"),
-                    created_at=parse_dt(m.get("created_at")),
-                ))
+            rows.append(_chat_row(username, m))
+    print(f"✅ Mensagens (db.json): {insert_chat_rows(rows)}")
 
 def import_chat_from_db_files():
+    rows = []
     data = load_json_any("chat_db.json")
     if isinstance(data, list):
         for m in data:
             username = m.get("username")
             if not username: continue
-            with session_scope() as db:
-                u = db.execute(select(User).where(User.username == username)).scalar_one_or_none()
-                if not u: continue
-                db.add(ChatMessage(
-                    user_id=u.id,
-                    role=m.get("role") or "user",
-                    text=m.get("text") or "",
-                    type=m.get("type") or "text",
-                    image_url=m.get("imageUrl"),
-                    created_at=parse_dt(m.get("created_at")),
-                ))
+            rows.append(_chat_row(username, m))
 
     bkp = load_json_any("chat_backup.json")
     if isinstance(bkp, dict):
@@ -159,64 +186,38 @@ def import_chat_from_db_files():
                 if not isinstance(node, dict):
                     continue
                 if "username" in node and "chat" in node and isinstance(node["chat"], list):
-                    username = node["username"]
                     for m in node["chat"]:
-                        with session_scope() as db:
-                            u = db.execute(select(User).where(User.username == username)).scalar_one_or_none()
-                            if not u: continue
-                            db.add(ChatMessage(
-                                user_id=u.id,
-                                role=m.get("role") or "user",
-                                text=m.get("text") or "",
-                                type=m.get("type") or "text",
-                                created_at=parse_dt(m.get("created_at")),
-                            ))
+                        rows.append(_chat_row(node["username"], m, with_image=False))
                 if "username" in node and "text" in node:
-                    username = node["username"]
-                    with session_scope() as db:
-                        u = db.execute(select(User).where(User.username == username)).scalar_one_or_none()
-                        if not u: continue
-                        db.add(ChatMessage(
-                            user_id=u.id,
-                            role=node.get("role") or "user",
-                            text=node.get("text") or "",
-                            type=node.get("type") or "text",
-                            created_at=parse_dt(node.get("created_at")),
-                        ))
+                    rows.append(_chat_row(node["username"], node, with_image=False))
     elif isinstance(bkp, dict):
         for _, node in bkp.items():
             if isinstance(node, dict) and node.get("username") and node.get("text"):
-                username = node.get("username")
-                with session_scope() as db:
-                    u = db.execute(select(User).where(User.username == username)).scalar_one_or_none()
-                    if not u: continue
-                    db.add(ChatMessage(
-                        user_id=u.id,
-                        role=node.get("role") or "user",
-                        text=node.get("text") or "",
-                        type=node.get("type") or "text",
-                        created_at=parse_dt(node.get("created_at")),
-                    ))
+                rows.append(_chat_row(node["username"], node, with_image=False))
+    print(f"✅ Mensagens (chat_db/chat_backup): {insert_chat_rows(rows)}")
 
 def import_meals():
+    ids = _user_ids()
     for fname in ("meals_db.json", "meals_backup.json"):
         data = load_json_any(fname)
         if isinstance(data, list):
+            payload = []
             for r in data:
-                username = r.get("usuario") or r.get("username")
-                if not username: continue
+                uid = ids.get(r.get("usuario") or r.get("username"))
+                if not uid: continue
+                payload.append({
+                    "user_id": uid,
+                    "analysis": r.get("analise") or {},
+                    "image_name": r.get("imagem_nome"),
+                    "created_at": parse_dt(r.get("data")),
+                })
+            if payload:
                 with session_scope() as db:
-                    u = db.execute(select(User).where(User.username == username)).scalar_one_or_none()
-                    if not u: continue
-                    db.add(MealAnalysis(
-                        user_id=u.id,
-                        analysis=r.get("analise") or {},
-                        image_name=r.get("imagem_nome"),
-                        created_at=parse_dt(r.get("data")),
-                    ))
+                    db.execute(insert(MealAnalysis), payload)
 
 def main():
     print("🚚 Iniciando ETL TinyDB → PostgreSQL")
+    init_schema()
     import_users()
     import_chat_from_embedded()
     import_chat_from_db_files()
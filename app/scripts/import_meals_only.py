@@ -1,8 +1,10 @@
 # app/scripts/import_meals_only.py
-import os, json
+import os
+
+import orjson
 from datetime import datetime
 from sqlalchemy import select, func
-from app.db import session_scope, User, MealAnalysis
+from app.db import init_schema, session_scope, User, MealAnalysis
 
 # procura arquivos na raiz e em app/
 HERE = os.path.abspath(os.path.dirname(__file__))      # app/scripts
@@ -23,9 +25,9 @@ def load_json_any(*names):
         if not p: 
             continue
         try:
-            with open(p, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
+            with open(p, "rb") as f:
+                return orjson.loads(f.read())
+        except orjson.JSONDecodeError:
             print(f"⚠️  JSON inválido: {p}")
     print(f"⚠️  Arquivo não encontrado: {', '.join(names)}")
     return None
@@ -86,5 +88,6 @@ def import_meals():
 
 if __name__ == "__main__":
     print("🍽️ Importando apenas refeições…")
+    init_schema()
     import_meals()
     print("✅ Concluído.")
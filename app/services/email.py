@@ -1,9 +1,17 @@
 import os
+import logging
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import Optional
 
+logger = logging.getLogger(__name__)
+
+SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.hostinger.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+EMAIL_USER = os.getenv("EMAIL_USER")
+EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
+
 def send_access_email(
    to: str, 
    name: Optional[str] = None,
@@ -12,13 +20,8 @@ def send_access_email(
 ):
    """Envia email de acesso liberado"""
    
-   smtp_server = os.getenv("SMTP_SERVER", "smtp.hostinger.com")
-   smtp_port = int(os.getenv("SMTP_PORT", "587"))
-   email_user = os.getenv("EMAIL_USER")
-   email_password = os.getenv("EMAIL_PASSWORD")
-   
-   if not email_user or not email_password:
-       print("Configuracoes de email nao encontradas")
+   if not EMAIL_USER or not EMAIL_PASSWORD:
+       logger.warning("Configuracoes de email nao encontradas")
        return
    
    if not subject:
@@ -29,19 +32,19 @@ def send_access_email(
    
    try:
        msg = MIMEMultipart()
-       msg['From'] = f"NutriFlow <{email_user}>"
+       msg['From'] = f"NutriFlow <{EMAIL_USER}>"
        msg['To'] = to
        msg['Subject'] = subject
        
        msg.attach(MIMEText(body, 'plain', 'utf-8'))
        
-       with smtplib.SMTP(smtp_server, smtp_port) as server:
+       with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
            server.starttls()
-           server.login(email_user, email_password)
+           server.login(EMAIL_USER, EMAIL_PASSWORD)
            server.send_message(msg)
        
-       print(f"Email enviado para {to}")
+       logger.info("Email enviado para %s", to)
        
    except Exception as e:
-       print(f"Erro ao enviar email: {e}")
+       logger.error("Erro ao enviar email: %s", e)
        raise
@@ -1,36 +1,15 @@
 # app/services/lina_context.py
 from typing import Optional, Tuple, Dict, Any, List, Literal
 import os
+import threading
 
-# DB
-try:
-    import psycopg2
-    import psycopg2.extras
-except ImportError as e:
-    raise RuntimeError("psycopg2 não encontrado. Adicione 'psycopg2-binary' ao requirements.txt") from e
+from cachetools import TTLCache
+
+from app.db import buscar_perfil, registrar_invalidacao_usuario
 
 SexType = Literal["M", "F"]
 GoalType = Literal["lose", "maintain", "gain"]
-ALLOWED_ACTIVITY = {1.2, 1.375, 1.55, 1.725, 1.9}
-
-# ---------- DB helpers ----------
-def _dsn_from_env() -> dict:
-    url = os.getenv("DATABASE_URL")
-    if url:
-        return {"dsn": url}
-    return {
-        "host": os.getenv("PGHOST") or os.getenv("DB_HOST") or "127.0.0.1",
-        "port": int(os.getenv("PGPORT") or 5432),
-        "dbname": os.getenv("PGDATABASE") or os.getenv("DB_NAME") or "nutriflow",
-        "user": os.getenv("PGUSER") or os.getenv("DB_USER") or "nutriflow_user",
-        "password": os.getenv("PGPASSWORD") or os.getenv("DB_PASSWORD") or None,
-    }
-
-def _get_conn():
-    cfg = _dsn_from_env()
-    if "dsn" in cfg:
-        return psycopg2.connect(cfg["dsn"], sslmode=os.getenv("PGSSLMODE","prefer"))
-    return psycopg2.connect(**cfg)
+ALLOWED_ACTIVITY = frozenset({1.2, 1.375, 1.55, 1.725, 1.9})
 
 # ---------- Nutrition rules ----------
 def _map_objetivo_to_goal_type(obj: Optional[str]) -> GoalType:
@@ -107,50 +86,98 @@ def _compute_targets(profile: Dict[str, Any]) -> Dict[str, Any]:
 
 # ---------- Profile loader ----------
 def _load_profile(username: str) -> Dict[str, Any]:
-    with _get_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-        cur.execute("""
-            SELECT sex, age, height_cm, current_weight, activity_level, goal_type,
-                   pace_kg_per_week, restrictions, confirm_low_calorie, objetivo
-            FROM public.users
-            WHERE username = %s
-        """, (username,))
-        row = cur.fetchone()
-        if not row:
-            raise ValueError("Usuário não encontrado")
-
-        sex_norm: Optional[SexType] = None
-        if isinstance(row["sex"], str) and row["sex"].strip().upper() in ("M","F"):
-            sex_norm = row["sex"].strip().upper()  # type: ignore
-
-        restrictions = row.get("restrictions") or []
-        if not isinstance(restrictions, list):
-            restrictions = []
-
-        goal_type: GoalType = (row.get("goal_type") or _map_objetivo_to_goal_type(row.get("objetivo")))  # type: ignore
-
-        profile = {
-            "sex": sex_norm,
-            "age": int(row["age"] or 0),
-            "height_cm": float(row["height_cm"] or 0.0),
-            "current_weight": float(row["current_weight"] or 0.0),
-            "activity_level": float(row["activity_level"] or 1.2),
-            "goal_type": goal_type,
-            "pace_kg_per_week": float(row["pace_kg_per_week"]) if row["pace_kg_per_week"] is not None else None,
-            "restrictions": [str(x) for x in restrictions],
-            "confirm_low_calorie": bool(row["confirm_low_calorie"]),
-        }
-        return profile
+    row = buscar_perfil(username)
+    if not row:
+        raise ValueError("Usuário não encontrado")
+
+    sex_norm: Optional[SexType] = None
+    if isinstance(row["sex"], str) and row["sex"].strip().upper() in ("M","F"):
+        sex_norm = row["sex"].strip().upper()  # type: ignore
+
+    restrictions = row.get("restrictions") or []
+    if not isinstance(restrictions, list):
+        restrictions = []
+
+    goal_type: GoalType = (row.get("goal_type") or _map_objetivo_to_goal_type(row.get("objetivo")))  # type: ignore
+
+    profile = {
+        "sex": sex_norm,
+        "age": int(row["age"] or 0),
+        "height_cm": float(row["height_cm"] or 0.0),
+        "current_weight": float(row["current_weight"] or 0.0),
+        "activity_level": float(row["activity_level"] or 1.2),
+        "goal_type": goal_type,
+        "pace_kg_per_week": float(row["pace_kg_per_week"]) if row["pace_kg_per_week"] is not None else None,
+        "restrictions": [str(x) for x in restrictions],
+        "confirm_low_calorie": bool(row["confirm_low_calorie"]),
+    }
+    return profile
+
+# ---------- Cache do contexto / prompt ----------
+# o perfil quase não muda entre mensagens seguidas; toda escrita em `users` passa por
+# invalidar_cache_usuario, então o TTL só cobre escritas feitas fora do processo
+_CACHE_TTL_S = int(os.getenv("PROMPT_CACHE_TTL_S", "600"))
+_CTX_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=_CACHE_TTL_S)     # perfil + metas
+_PROMPT_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=_CACHE_TTL_S)  # (prompt, ctx)
+_prompt_lock = threading.Lock()
+
+def invalidate_profile(username: Optional[str] = None) -> None:
+    with _prompt_lock:
+        if username is None:
+            _CTX_CACHE.clear()
+            _PROMPT_CACHE.clear()
+        else:
+            _CTX_CACHE.pop(username, None)
+            _PROMPT_CACHE.pop(username, None)
+
+registrar_invalidacao_usuario(invalidate_profile)
 
 # ---------- Public API ----------
+def get_targets_ctx(username: str) -> Dict[str, Any]:
+    """
+    {"profile": ..., "targets": ... | None} sem montar o prompt (comandos só precisam das metas).
+    Lança ValueError se o usuário não existe. Em cache; não altere o dict devolvido.
+    """
+    with _prompt_lock:
+        cached = _CTX_CACHE.get(username)
+    if cached is not None:
+        return cached
+    profile = _load_profile(username)
+    ctx = {"profile": profile, "targets": _compute_targets(profile) if _perfil_completo(profile) else None}
+    with _prompt_lock:
+        _CTX_CACHE[username] = ctx
+    return ctx
+
 def build_lina_system_prompt(username: str) -> Tuple[str, Dict[str, Any]]:
     """
     Retorna (system_prompt_str, context_dict).
-    Lança ValueError se perfil mínimo estiver ausente (sex/age/height/current_weight/activity/goal).
+    Lança ValueError se o usuário não existe; perfil incompleto gera prompt pedindo os dados.
+    O resultado fica em cache por alguns minutos; não altere o context_dict devolvido.
     """
-    profile = _load_profile(username)
+    with _prompt_lock:
+        cached = _PROMPT_CACHE.get(username)
+    if cached is not None:
+        return cached
+    result = _build_lina_system_prompt(username, get_targets_ctx(username))
+    with _prompt_lock:
+        _PROMPT_CACHE[username] = result
+    return result
+
+def lina_prompt_em_cache(username: str) -> Optional[str]:
+    """Prompt já montado ou None se não estiver em cache (só memória: seguro no event loop)."""
+    with _prompt_lock:
+        cached = _PROMPT_CACHE.get(username)
+    return cached[0] if cached is not None else None
+
+def _perfil_completo(profile: Dict[str, Any]) -> bool:
+    return bool(profile["sex"]) and profile["age"] > 0 and profile["height_cm"] > 0 and profile["current_weight"] > 0
+
+def _build_lina_system_prompt(username: str, ctx: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    profile = ctx["profile"]
+    targets = ctx["targets"]
 
     # validação mínima para metas
-    if not profile["sex"] or profile["age"] <= 0 or profile["height_cm"] <= 0 or profile["current_weight"] <= 0:
+    if targets is None:
         # prompt sem metas, pedindo para completar perfil
         sys = f"""Você é a Lina, assistente nutricional da NutriFlow.
 O usuário {username} ainda não completou o perfil mínimo (sexo, idade, altura, peso).
@@ -160,10 +187,7 @@ Ao responder:
 - Use português-BR, direto ao ponto e educado.
 - Foque em coletar dados: sexo (M/F), idade (anos), altura (cm), peso (kg), nível de atividade (1.2, 1.375, 1.55, 1.725 ou 1.9) e objetivo (perder, manter, ganhar).
 - Após coletar, confirme e diga que vai calcular metas."""
-        return sys, {"profile": profile, "targets": None}
-
-    # perfil completo -> calcular metas
-    targets = _compute_targets(profile)
+        return sys, ctx
 
     # formatação
     restr = ", ".join(profile["restrictions"]) if profile["restrictions"] else "sem restrições informadas"
@@ -196,4 +220,4 @@ Instruções de resposta:
 - Se o usuário estiver perto de extrapolar (>5%) ou de não bater a meta, alerte com educação e sugira ajustes específicos.
 - Evite assuntos fora de nutrição.
 """
-    return sys, {"profile": profile, "targets": targets}
+    return sys, ctx
@@ -0,0 +1,28 @@
+# app/services/openai_client.py
+import os
+import logging
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+if not OPENAI_API_KEY:
+    logger.error("OPENAI_API_KEY não está definida no .env")
+
+
+@lru_cache(maxsize=1)
+def get_openai() -> AsyncOpenAI:
+    """Cliente único do processo: chat e imagem reaproveitam o mesmo pool HTTP (keep-alive/TLS)."""
+    # criado no primeiro uso: import do módulo não abre pool, e sem chave
+    # o import não quebra (AsyncOpenAI(api_key=None) levanta erro)
+    return AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+
+async def fechar_openai() -> None:
+    # só fecha se o cliente chegou a ser criado
+    if get_openai.cache_info().currsize:
+        await get_openai().close()
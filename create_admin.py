@@ -3,14 +3,47 @@ import os
 import uuid
 import getpass
 from pathlib import Path
+import atexit
+import orjson
 from passlib.context import CryptContext
 from tinydb import TinyDB, Query
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import Storage
+
+
+class ORJSONStorage(Storage):
+    """Storage TinyDB com orjson: parse/dump em Rust, escrita atômica (temp + os.replace)."""
+
+    def __init__(self, path, create_dirs=False, encoding=None, access_mode='r+b', **kwargs):
+        self._path = Path(path)
+        if create_dirs:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._path.touch(exist_ok=True)
+
+    def read(self):
+        raw = self._path.read_bytes()
+        return orjson.loads(raw) if raw else None
+
+    def write(self, data):
+        # crash no meio deixa o db.json antigo intacto (nunca meio escrito ou com sobra do anterior)
+        tmp = self._path.with_name(self._path.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path)
+
+    def close(self):
+        pass
+
 
 # Configurações TinyDB e hashing
 BASE_DIR = Path(__file__).parent
 DB_PATH = BASE_DIR / 'db.json'
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-db = TinyDB(DB_PATH)
+CachingMiddleware.WRITE_CACHE_SIZE = 1000
+db = TinyDB(DB_PATH, storage=CachingMiddleware(ORJSONStorage))
+atexit.register(db.storage.flush)
 User = Query()
 
 # Criação interativa
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+import app.endpoints.chat as chat
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Troca cada handler da tabela por um que só registra (nome, args)."""
+    seen = []
+
+    def recorder(name):
+        async def handler(username, rest):
+            seen.append((name, rest))
+            return name
+        return handler
+
+    table = tuple(
+        (prefixes, anywhere, recorder(handler.__name__))
+        for prefixes, anywhere, handler in chat._COMMANDS
+    )
+    monkeypatch.setattr(chat, "_COMMANDS", table)
+    return seen
+
+
+def _run(message):
+    return asyncio.run(chat._handle_command("ana", message))
+
+
+@pytest.mark.parametrize("message, handler, rest", [
+    ("/perfil age=30", "_cmd_perfil", "age=30"),
+    ("  /PERFIL Age=30  ", "_cmd_perfil", "Age=30"),
+    ("/confirmar_kcal_baixa", "_cmd_confirmar_kcal_baixa", ""),
+    ("/liberar_kcal_baixa", "_cmd_confirmar_kcal_baixa", ""),
+    ("/confirmar_deficit", "_cmd_confirmar_kcal_baixa", ""),
+    ("/liberar_deficit", "_cmd_confirmar_kcal_baixa", ""),
+    ("/revogar_kcal_baixa", "_cmd_revogar_kcal_baixa", ""),
+    ("/revogar_deficit", "_cmd_revogar_kcal_baixa", ""),
+    ("/bloquear_deficit", "_cmd_revogar_kcal_baixa", ""),
+    ("/limpar_dia", "_cmd_limpar_dia", ""),
+    ("/status", "_cmd_status", ""),
+    ("/consumo kcal=700 p=50", "_cmd_consumo", "kcal=700 p=50"),
+    ("/refeicao 150g frango", "_cmd_refeicao", "150g frango"),
+])
+def test_command_table(calls, message, handler, rest):
+    assert _run(message) == handler
+    assert calls == [(handler, rest)]
+
+
+@pytest.mark.parametrize("message, handler, rest", [
+    # prefixo, não palavra exata (igual ao if/startswith original)
+    ("/statusx", "_cmd_status", "x"),
+    ("/consumo1300", "_cmd_consumo", "1300"),
+    # alias legado em qualquer posição, com ou sem "/"
+    ("pode liberar_deficit por favor", "_cmd_confirmar_kcal_baixa", ""),
+    ("/status liberar_deficit", "_cmd_confirmar_kcal_baixa", ""),
+    # ordem da tabela: /perfil é testado antes do alias
+    ("/perfil liberar_deficit", "_cmd_perfil", "liberar_deficit"),
+])
+def test_legacy_matching(calls, message, handler, rest):
+    assert _run(message) == handler
+    assert calls == [(handler, rest)]
+
+
+@pytest.mark.parametrize("message", ["oi Lina", "/desconhecido", "quero ver meu status", ""])
+def test_not_a_command(calls, message):
+    assert _run(message) is None
+    assert calls == []
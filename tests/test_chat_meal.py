@@ -0,0 +1,68 @@
+import asyncio
+from types import SimpleNamespace
+
+import orjson
+import pytest
+
+import app.endpoints.chat as chat
+
+_RAW = orjson.dumps({
+    "items": [{"nome": "arroz", "quantidade": "1 xíc."}],
+    "totais": {"kcal": 200, "protein_g": 4, "carbs_g": 44, "fat_g": 0.5},
+    "dica": "ok",
+}).decode()
+
+
+@pytest.fixture
+def openai_calls(monkeypatch):
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs)
+        msg = SimpleNamespace(content=_RAW)
+        return SimpleNamespace(choices=[SimpleNamespace(message=msg, finish_reason="stop")])
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(chat, "get_openai", lambda: client)
+    monkeypatch.setattr(chat, "_MEAL_CACHE", chat.TTLCache(maxsize=16, ttl=60))
+    return calls
+
+
+def _analyze(description):
+    return asyncio.run(chat._analyze_meal_text(description))
+
+
+def test_meal_cache_hit_devolve_copia(openai_calls):
+    first = _analyze("Arroz branco")
+    first["totais"]["kcal"] = 0.0
+    first["items"].clear()
+
+    second = _analyze("arroz  BRANCO")
+
+    assert len(openai_calls) == 1
+    assert second["totais"]["kcal"] == 200.0
+    assert second["items"] == [{"nome": "arroz", "quantidade": "1 xíc."}]
+    assert second is not first
+
+
+def test_meal_cache_ignora_descricao_longa(openai_calls):
+    longa = "arroz " * (chat._MEAL_CACHE_MAX_CHARS // 6 + 1)
+
+    _analyze(longa)
+    _analyze(longa)
+
+    assert len(openai_calls) == 2
+    assert len(chat._MEAL_CACHE) == 0
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Pão  com Ovo", "pao com ovo"),
+    ("  FEIJÃO\tcom\narroz ", "feijao com arroz"),
+    ("Maçã", "maca"),
+])
+def test_meal_key_normaliza(a, b):
+    assert chat._meal_key(a) == chat._meal_key(b) == b
+
+
+def test_meal_key_distingue_quantidades():
+    assert chat._meal_key("100g frango") != chat._meal_key("200g frango")
@@ -0,0 +1,81 @@
+import asyncio
+from types import SimpleNamespace
+
+import app.endpoints.chat as chat
+
+
+class _FakeStream:
+    def __init__(self, tokens):
+        self._tokens = iter(tokens)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(0)
+        try:
+            tok = next(self._tokens)
+        except StopIteration:
+            raise StopAsyncIteration
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=tok))])
+
+    async def close(self):
+        self.closed = True
+
+
+def _patch(monkeypatch, stream):
+    async def create(**kwargs):
+        return stream
+
+    async def no_command(username, message):
+        return None
+
+    async def no_messages(username, txt):
+        return []
+
+    saved = []
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(chat, "get_openai", lambda: client)
+    monkeypatch.setattr(chat, "_handle_command", no_command)
+    monkeypatch.setattr(chat, "_lina_messages", no_messages)
+    monkeypatch.setattr(chat, "salvar_chat_messages", lambda username, msgs: saved.append(msgs))
+    return saved
+
+
+async def _collect(limit=None):
+    resp = await chat.send_to_ai_stream(chat.ChatSendPayload(message="oi"), username="ana")
+    it = resp.body_iterator
+    out = []
+    try:
+        async for chunk in it:
+            out.append(chunk)
+            if limit and len(out) == limit:
+                break
+    finally:
+        await it.aclose()
+    return out
+
+
+def test_stream_completo_salva_antes_do_done(monkeypatch):
+    stream = _FakeStream(["Olá", " Ana"])
+    saved = _patch(monkeypatch, stream)
+
+    out = asyncio.run(_collect())
+
+    assert out == [
+        b'data: {"delta":"Ol\xc3\xa1"}\n\n',
+        b'data: {"delta":" Ana"}\n\n',
+        b"event: done\ndata: {}\n\n",
+    ]
+    assert saved == [[("user", "oi", "text"), ("bot", "Olá Ana", "text")]]
+
+
+def test_desconexao_fecha_stream_e_salva_parcial(monkeypatch):
+    stream = _FakeStream(["a", "b", "c", "d"])
+    saved = _patch(monkeypatch, stream)
+
+    asyncio.run(_collect(limit=2))
+
+    assert stream.closed
+    assert saved == [[("user", "oi", "text"), ("bot", "ab", "text")]]
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+
+def _criar_usuario(pg, username, **cols):
+    with pg.session_scope() as s:
+        user = pg.User(username=username, **cols)
+        s.add(user)
+        s.flush()
+        return user.id
+
+
+def test_metrics_le_usuario_do_banco_e_nao_do_cache(pg, username):
+    from app.endpoints.dashboard import get_dashboard_metrics
+
+    uid = _criar_usuario(pg, username, height_cm=180.0, initial_weight=90.0, objetivo="perder")
+    now = datetime.now(timezone.utc)
+    with pg.session_scope() as s:
+        s.add_all([
+            pg.WeightLog(user_id=uid, recorded_at=now - timedelta(days=40), weight=88.0),
+            pg.WeightLog(user_id=uid, recorded_at=now - timedelta(days=1), weight=81.0),
+        ])
+
+    # usuário "em cache" desatualizado: só o id é usado
+    out = get_dashboard_metrics(period=None, current_user={"id": uid, "height_cm": None, "objetivo": None})
+
+    assert (out.height_cm, out.initial_weight, out.objective) == (180.0, 90.0, "perder")
+    assert [h.weight for h in out.history] == [88.0, 81.0]
+    assert out.current_weight == 81.0
+    assert out.weight_lost == 9.0
+    assert out.bmi == 25.0
+
+    recent = get_dashboard_metrics(period="7d", current_user={"id": uid})
+    assert [h.weight for h in recent.history] == [81.0]
+
+
+def test_metrics_sem_logs_no_periodo(pg, username):
+    from app.endpoints.dashboard import get_dashboard_metrics
+
+    uid = _criar_usuario(pg, username, height_cm=170.0, objetivo="manter")
+
+    out = get_dashboard_metrics(period="7d", current_user={"id": uid})
+
+    assert (out.height_cm, out.objective) == (170.0, "manter")
+    assert out.history == [] and out.current_weight is None and out.bmi is None
+
+
+def test_metrics_usuario_inexistente(pg):
+    from uuid import uuid4
+    from app.endpoints.dashboard import get_dashboard_metrics
+
+    with pytest.raises(HTTPException) as exc:
+        get_dashboard_metrics(period=None, current_user={"id": uuid4()})
+    assert exc.value.status_code == 401
@@ -0,0 +1,83 @@
+from collections import deque
+
+import pytest
+
+from app import db
+
+
+def _msg(role, text):
+    return {"role": role, "text": text, "type": "text", "imageUrl": None, "created_at": "2025-01-01T00:00:00"}
+
+
+# ---------- cache em memória (sem banco) ----------
+def test_em_cache_sem_entrada_devolve_none(monkeypatch):
+    monkeypatch.setattr(db, "_chat_recent", db.LRUCache(maxsize=4))
+    assert db.buscar_chat_history_em_cache("ana") is None
+
+
+def test_em_cache_devolve_ultimas_em_ordem(monkeypatch):
+    recent = deque([_msg("user", str(i)) for i in range(5)], maxlen=db._CHAT_RECENT_MAX)
+    monkeypatch.setattr(db, "_chat_recent", db.LRUCache(maxsize=4))
+    db._chat_recent["ana"] = recent
+
+    assert [m["text"] for m in db.buscar_chat_history_em_cache("ana", 3)] == ["2", "3", "4"]
+    assert [m["text"] for m in db.buscar_chat_history_em_cache("ana", 10)] == ["0", "1", "2", "3", "4"]
+    # acima do que o cache guarda: quem chamou precisa ir ao banco
+    assert db.buscar_chat_history_em_cache("ana", db._CHAT_RECENT_MAX + 1) is None
+
+
+# ---------- escrita / leitura no Postgres ----------
+def test_salvar_turno_e_ler_historico(pg, username):
+    pg.salvar_chat_messages(username, [("user", "oi", "text"), ("bot", "olá!", "text")])
+
+    hist = pg.buscar_chat_history(username, 10)
+
+    assert [(m["role"], m["text"]) for m in hist] == [("user", "oi"), ("bot", "olá!")]
+    # a primeira leitura popula o cache
+    assert pg.buscar_chat_history_em_cache(username, 10) == hist
+
+
+def test_write_through_apos_commit(pg, username):
+    assert pg.buscar_chat_history(username, 10) == []
+    assert pg.buscar_chat_history_em_cache(username, 10) == []
+
+    pg.salvar_chat_message(username, "user", "primeira")
+
+    (m,) = pg.buscar_chat_history_em_cache(username, 10)
+    assert (m["role"], m["text"]) == ("user", "primeira")
+    # o que está em memória é o que o banco devolve
+    assert pg._query_chat_history(username, 10) == [m]
+
+
+def test_turno_invalido_nao_grava_nada(pg, username):
+    with pytest.raises(ValueError):
+        pg.salvar_chat_messages(username, [("user", "oi", "text"), ("sistema", "x", "text")])
+
+    assert pg._query_chat_history(username, 10) == []
+
+
+def test_escrita_durante_select_nao_popula_cache(pg, username, monkeypatch):
+    query = pg._query_chat_history
+
+    def query_com_escrita_concorrente(uname, limit):
+        rows = query(uname, limit)
+        pg.salvar_chat_message(uname, "user", "chegou durante o SELECT")
+        return rows
+
+    monkeypatch.setattr(pg, "_query_chat_history", query_com_escrita_concorrente)
+
+    assert pg.buscar_chat_history(username, 10) == []
+    # snapshot anterior à escrita: não pode virar o cache
+    assert pg.buscar_chat_history_em_cache(username, 10) is None
+
+    monkeypatch.setattr(pg, "_query_chat_history", query)
+    assert [m["text"] for m in pg.buscar_chat_history(username, 10)] == ["chegou durante o SELECT"]
+
+
+def test_limite_maior_que_cache_vai_ao_banco(pg, username):
+    pg.salvar_chat_messages(username, [("user", str(i), "text") for i in range(3)])
+    pg.buscar_chat_history(username, 10)
+    with pg._chat_cache_lock:
+        pg._chat_recent[username].clear()  # cache "mentindo": só o banco tem as 3
+
+    assert len(pg.buscar_chat_history(username, pg._CHAT_RECENT_MAX + 1)) == 3
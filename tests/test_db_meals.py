@@ -0,0 +1,30 @@
+def test_meal_summary_projeta_totais_e_items(pg, username):
+    pg.salvar_meal_analysis(
+        username,
+        {"totais": {"kcal": 500.0}, "items": [{"nome": "arroz"}], "dica": "beba água", "_raw": "{}"},
+        "prato.jpg",
+    )
+
+    (meal,) = pg.buscar_meal_history(username, 5)
+
+    assert meal["analise"] == {"totais": {"kcal": 500.0}, "items": [{"nome": "arroz"}]}
+    assert meal["imagem_nome"] == "prato.jpg"
+
+
+def test_meal_summary_mantem_analise_em_texto(pg, username):
+    # /image/analyze grava a resposta do modelo como string JSONB
+    pg.salvar_meal_analysis(username, "🍽️ Alimentos identificados: arroz", "foto.jpg")
+
+    (meal,) = pg.buscar_meal_history(username, 5)
+
+    assert meal["analise"] == "🍽️ Alimentos identificados: arroz"
+
+
+def test_meal_history_completo_e_detalhe(pg, username):
+    analise = {"totais": {"kcal": 1.0}, "items": [], "dica": "ok"}
+    pg.salvar_meal_analysis(username, analise)
+
+    (meal,) = pg.buscar_meal_history(username, 5, completo=True)
+
+    assert meal["analise"] == analise
+    assert pg.buscar_meal_detail(username, meal["id"])["analise"] == analise
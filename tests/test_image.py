@@ -0,0 +1,23 @@
+import pytest
+
+from app.endpoints.image import _sniff_image_type
+
+
+@pytest.mark.parametrize("data, kind", [
+    (b"\xff\xd8\xff\xe0" + b"\0" * 8, "jpeg"),
+    (b"\x89PNG\r\n\x1a\n" + b"\0" * 8, "png"),
+    (b"GIF89a" + b"\0" * 8, "gif"),
+    (b"RIFF\x10\0\0\0WEBPVP8 ", "webp"),
+])
+def test_sniff_formatos_aceitos(data, kind):
+    assert _sniff_image_type(data) == kind
+
+
+@pytest.mark.parametrize("data", [
+    b"RIFF\x10\0\0\0WAVEfmt ",  # RIFF sem WEBP (áudio)
+    b"%PDF-1.7",
+    b"",
+])
+def test_sniff_desconhecido_usa_fallback(data):
+    assert _sniff_image_type(data) == "jpeg"
+    assert _sniff_image_type(data, fallback="octet-stream") == "octet-stream"